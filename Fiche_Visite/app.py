@@ -1,103 +1,59 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import re
 import io
-import pdfkit
-import tempfile 
 import base64 
 import json
 from datetime import datetime
-from pathlib import Path
-import platform
 import subprocess
 import os
-
-def get_logo_from_file():
-    # Get the absolute path to the logo file
-    current_dir = Path(__file__).parent
-    logo_path = current_dir / 'assets' / 'logo_br.jpg'
-    
-    try:
-        with open(logo_path, 'rb') as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    except Exception as e:
-        print(f"Error loading logo: {e}")
-        return None
+import uuid
+from renderer import PDF_OPTIONS, RenderPool, get_engine
+from image_prep import CSS_DPI, ThumbnailPool, prepared_base64
+from jobs import STAGES, JobManager
+from pdf_tools import append_pdf
+from report_assets import get_logo_from_file
+from report_template import TEMPLATE_VERSION, build_report_html
+from fiche import (BASIC_FIELDS, CATALOGUE, DEFAULT_EVALUATION, FIELD_DEFAULTS, MAX_FICHE_BYTES, FicheError,
+                   categories, encode_fiche, parse_date, parse_fiche)
+from scoring import category_notes, category_score, compute_scores, global_score
+from pdf_cache import PdfCache, digest, report_cache_key
+from visit_store import VisitStore, default_path
+from bulk_import import import_fiches
+from consolidated import render_consolidated
+from drafts import DraftStore, DraftWriter
+from uploads import SessionUploads, UploadError, clean_uploads
+from metrics import (PDF_CACHE_HITS, PDF_CACHE_MISSES, PDF_RENDER_FAILURES, PDF_RENDERS,
+                     REGISTRY, serve_metrics, span)
 
 # Load the logo once when the app starts
 LOGO_BR_BASE64 = get_logo_from_file()
+LOGO_BR_DIGEST = digest(LOGO_BR_BASE64)
+
+# Fiches téléchargées au format compact (BR_FICHE_FORMAT=1 pour l'ancien format), gzip avec BR_FICHE_GZIP=1
+FICHE_COMPACT = os.environ.get('BR_FICHE_FORMAT', '2') != '1'
+FICHE_GZIP = os.environ.get('BR_FICHE_GZIP') == '1'
 
 def check_required_fields(adresse, conducteur, chef_chantier, contact_chantier, redacteur_rapport):
     return all([adresse.strip(), conducteur.strip(), chef_chantier.strip(), contact_chantier.strip(), redacteur_rapport.strip()])
 
 st.set_page_config(page_title="RAPPORT DE VISITE BR CONSULT", layout="wide")
 
-# Dictionnaire des critères par catégorie
-categories = {
-    "Administratif": [
-        "PPSPS ou Plan de Prévention disponible(s) sur chantier",
-        "Rapport(s) de vérification échafaudage / appareils de levage établi(s)",
-        "Rapport(s) de vérification des machine(s) utilisées établi(s)",
-        "Affichage",
-        "Autres documents disponibles"
-    ],
-    "Sécurité": [
-        "Locaux de vie",
-        "Port des EPI et vêtements de travail classiques",
-        "Échafaudage / protection collective",
-        "Risques de chute",
-        "Risque électrique",
-        "Risques liés aux produits chimiques",
-        "Risques incendie, explosion",
-        "Connaissance situation d'urgence",
-        "Risques liés à l'activité physique  - manutention manuelle et mécanique",
-        "Prise en compte demandes CARSAT / Direction",
-        "Organisation chantier",
-        "Réalisation des actions précédentes",
-        "Autres risques"
-    ],
-    "Environnement": [
-        "Propreté générale du chantier",
-        "Protection sol, pelouse, flore",
-        "Gestion des déchets",
-        "Impact riverains",
-        "Autres"
-    ]
-}
-
 # Initialize session state for all form fields if they don't exist
 def init_session_state():
     if 'initialized' not in st.session_state:
-        defaults = {
-            'nom_client': '',  # New field for client name
-            'date': datetime.now().date(),
-            'heure': '',
-            'adresse': '',
-            'presence_sst': 'Non',
-            'effectif': 0,            
-            'conducteur': '',
-            'chef_chantier': '',
-            'contact_chantier': '',
-            'redacteur_rapport': '',
-            'travaux_selectionnes': [],
-            'travaux_autres': '',
-            'theme_visite': '',
-            'evaluation_generale': '',
-            'lien_photos': ''  # Nouveau champ pour le lien Dropbox
-        }
+        defaults = dict(FIELD_DEFAULTS, date=datetime.now().date())
         
         for key, value in defaults.items():
             if key not in st.session_state:
-                st.session_state[key] = value
+                st.session_state[key] = list(value) if isinstance(value, list) else value
                 
         # Initialize criteria fields
-        for cat in ['Administratif', 'Sécurité', 'Environnement']:
-            for critere in categories[cat]:
-                eval_key = f"{cat}_{critere}"
-                obs_key = f"obs_{cat}_{critere}"
-                if eval_key not in st.session_state:
-                    st.session_state[eval_key] = "Non Applicable"
-                if obs_key not in st.session_state:
-                    st.session_state[obs_key] = ""
+        for critere in CATALOGUE.criteria:
+            if critere.eval_key not in st.session_state:
+                st.session_state[critere.eval_key] = DEFAULT_EVALUATION
+            if critere.obs_key not in st.session_state:
+                st.session_state[critere.obs_key] = ""
                     
         st.session_state['initialized'] = True
 
@@ -106,59 +62,260 @@ if "file_processed" not in st.session_state:
     st.session_state.file_processed = False
     init_session_state()
 
-# Add file loader at the top
-uploaded_json = st.file_uploader("📂 Charger une fiche sauvegardée", type=['json'])
+# Fichiers envoyés : copiés dans un répertoire propre à la session, qui ne garde
+# que leurs références ; le répertoire disparaît avec la session
+@st.cache_resource
+def clean_old_uploads():
+    return clean_uploads()
+
+clean_old_uploads()
+
+def session_uploads():
+    if 'uploads' not in st.session_state:
+        st.session_state['uploads'] = SessionUploads()
+    return st.session_state['uploads']
+
+def uploader_key(kind):
+    return f"{kind}_{st.session_state.get(f'{kind}_generation', 0)}"
+
+def reset_uploader(kind):
+    # A new widget key makes Streamlit drop the uploaded bytes from memory
+    st.session_state[f'{kind}_generation'] = st.session_state.get(f'{kind}_generation', 0) + 1
+
+def spool_uploads(kind, files):
+    handles = []
+    errors = st.session_state.setdefault(f'{kind}_errors', [])
+    for upload in files:
+        try:
+            handles.append(session_uploads().spool(upload))
+        except UploadError as e:
+            errors.append(str(e))
+    reset_uploader(kind)
+    return handles
+
+def show_upload_errors(kind):
+    for error in st.session_state.pop(f'{kind}_errors', []):
+        st.warning(f"⚠️ {error}")
+
+# Fiches enregistrées sur le serveur, partagées entre les sessions
+@st.cache_resource
+def get_visit_store():
+    return VisitStore(default_path())
+
+visit_store = get_visit_store()
+
+def load_fiche_into_state(saved_data):
+    st.session_state['date'] = parse_date(saved_data['date'])
+
+    # Set all basic form fields from saved data
+    for field in BASIC_FIELDS:
+        if field in saved_data:
+            st.session_state[field] = saved_data[field]
+
+    # Set criteria evaluations and observations (parse_fiche already
+    # moved renamed criteria to their current keys)
+    for key in CATALOGUE.eval_keys + CATALOGUE.obs_keys:
+        if key in saved_data:
+            st.session_state[key] = saved_data[key]
+
+    st.session_state.pop('notes_finales', None)
+
+    # Show summary of loaded data
+    loaded_fields = len([k for k in saved_data.keys() if saved_data[k]])
+    st.success(f"✅ Fiche chargée avec succès ! - Date de visite : {saved_data['date']} - Adresse : {saved_data['adresse']} - {loaded_fields} champs chargés au total")
+
+def visit_label(visit):
+    label = f"{visit['date']} – {visit['nom_client'] or 'Client non renseigné'} – {visit['adresse']}"
+    if visit['redacteur_rapport']:
+        label += f" ({visit['redacteur_rapport']})"
+    return label
+
+# Brouillons enregistrés automatiquement sur le serveur pendant la saisie
+@st.cache_resource
+def get_draft_writer():
+    store = DraftStore(default_path())
+    store.prune()
+    return DraftWriter(store)
+
+draft_writer = get_draft_writer()
+draft_store = draft_writer.store
+
+DRAFT_FIELDS = ['date'] + BASIC_FIELDS + list(CATALOGUE.eval_keys + CATALOGUE.obs_keys)
+
+def draft_snapshot():
+    snapshot = {}
+    for field in DRAFT_FIELDS:
+        value = st.session_state.get(field)
+        snapshot[field] = str(value) if field == 'date' else list(value) if isinstance(value, list) else value
+    return snapshot
+
+def autosave_brouillon():
+    # Hands the fields changed since the last call to the debounced writer
+    snapshot = draft_snapshot()
+    previous = st.session_state.get('draft_snapshot')
+    st.session_state['draft_snapshot'] = snapshot
+    if previous is None:
+        return
+    changed = {field: value for field, value in snapshot.items() if previous.get(field) != value}
+    if not changed:
+        return
+    draft_id = st.session_state.get('draft_id')
+    if draft_id is None:
+        # A new draft starts from the whole form, later writes only carry changes
+        draft_id = st.session_state['draft_id'] = uuid.uuid4().hex
+        st.query_params['brouillon'] = draft_id
+        st.session_state['draft_offer_closed'] = True
+        changed = snapshot
+    draft_writer.update(
+        draft_id, changed,
+        label=f"{snapshot['adresse'] or 'Adresse non renseignée'} – {snapshot['nom_client'] or 'Client non renseigné'}",
+        visit_id=st.session_state.get('visit_id'),
+        catalogue_version=CATALOGUE.version
+    )
+
+def restore_draft(draft):
+    draft_writer.flush(draft['id'])
+    fields = draft_store.load(draft['id'])
+    fields['catalogue_version'] = draft['catalogue_version'] or CATALOGUE.version
+    CATALOGUE.migrate(fields)
+    if 'date' in fields:
+        st.session_state['date'] = parse_date(fields['date'])
+    for field in DRAFT_FIELDS[1:]:
+        if field in fields:
+            st.session_state[field] = fields[field]
+    st.session_state.pop('notes_finales', None)
+    if draft['visit_id'] is not None:
+        st.session_state['visit_id'] = draft['visit_id']
+    # Continued under a new id: another tab may still be writing to the old one
+    snapshot = st.session_state['draft_snapshot'] = draft_snapshot()
+    draft_id = st.session_state['draft_id'] = uuid.uuid4().hex
+    draft_writer.update(draft_id, snapshot, label=draft['label'], visit_id=draft['visit_id'],
+                        catalogue_version=CATALOGUE.version)
+    draft_writer.flush(draft_id)
+    st.query_params['brouillon'] = draft_id
+
+def proposer_brouillon():
+    # Only in a session that has not started its own draft, and only the draft
+    # this browser was working on (its id is kept in the page URL)
+    if st.session_state.get('draft_offer_closed') or 'brouillon' not in st.query_params:
+        return
+    draft = draft_store.get(st.query_params['brouillon'])
+    if draft is None:
+        return
+    updated = datetime.fromisoformat(draft['updated_at']).strftime('%d/%m/%Y à %H:%M')
+    st.info(f"📝 Brouillon non terminé : {draft['label']} (enregistré le {updated})")
+    col_restaurer, col_ignorer = st.columns(2)
+    with col_restaurer:
+        if st.button("♻️ Reprendre le brouillon"):
+            try:
+                restore_draft(draft)
+            except (FicheError, ValueError) as e:
+                st.error(f"❌ Brouillon illisible : {e}")
+                st.session_state['draft_offer_closed'] = True
+                return
+            st.session_state['draft_offer_closed'] = True
+            st.rerun()
+    with col_ignorer:
+        if st.button("Ignorer"):
+            st.session_state['draft_offer_closed'] = True
+            st.rerun()
+
+proposer_brouillon()
+
+# Add file loader at the top, next to the server-side visit picker
+col_upload, col_store = st.columns(2)
+
+with col_upload:
+    uploaded_json = st.file_uploader(
+        "📂 Charger une fiche sauvegardée", type=['json', 'gz'], key=uploader_key('fiche_upload')
+    )
+
+with col_store:
+    recherche = st.text_input(
+        "🔎 Charger une visite précédente",
+        placeholder="Client, adresse, date (AAAA-MM-JJ) ou rédacteur",
+        key='visit_search'
+    )
+    visites = visit_store.search(recherche)
+    visite_choisie = st.selectbox(
+        "Visites enregistrées",
+        visites,
+        format_func=visit_label,
+        index=None,
+        placeholder="Aucune visite trouvée" if not visites else "Choisissez une visite",
+        label_visibility="collapsed"
+    )
+    if st.button("📥 Charger la visite", disabled=visite_choisie is None):
+        try:
+            with span('load', source='store'):
+                saved_data = visit_store.load(visite_choisie['id'])
+                if saved_data is not None:
+                    load_fiche_into_state(saved_data)
+            if saved_data is None:
+                st.error("❌ Cette visite n'existe plus sur le serveur")
+            else:
+                st.session_state['visit_id'] = visite_choisie['id']
+        except FicheError as e:
+            st.error(f"❌ {e}")
+
+# Import en lot d'une archive de fiches dans la base serveur, sans recharger la page par fiche
+@st.fragment
+def import_en_lot():
+    fichiers = st.file_uploader(
+        "Archive ZIP ou plusieurs fiches JSON",
+        type=['zip', 'json', 'gz'],
+        accept_multiple_files=True,
+        key=uploader_key('bulk_import')
+    )
+    if st.button("📦 Importer dans la base", disabled=not fichiers):
+        with span('bulk_import', files=len(fichiers)):
+            rapport = import_fiches(fichiers, visit_store)
+        # Emptied for the next archive; the report below stays until the next interaction
+        reset_uploader('bulk_import')
+        importees = sum(1 for entry in rapport if entry['ok'])
+        doublons = sum(1 for entry in rapport if entry.get('duplicate'))
+        erreurs = [entry for entry in rapport if not entry['ok'] and not entry.get('duplicate')]
+        if importees:
+            st.success(f"✅ {importees} fiche(s) importée(s) dans la base")
+        if doublons:
+            st.info(f"ℹ️ {doublons} fiche(s) déjà importée(s), ignorée(s)")
+        if erreurs:
+            st.error(f"❌ {len(erreurs)} fichier(s) non importé(s)")
+            st.dataframe([{'Fichier': entry['file'], 'Erreur': entry['error']} for entry in erreurs])
+        if not rapport:
+            st.warning("Aucune fiche trouvée dans les fichiers envoyés")
+        st.download_button(
+            label="📥 Télécharger le rapport d'import",
+            data=json.dumps(rapport, ensure_ascii=False, indent=2).encode('utf-8'),
+            file_name=f"import_fiches_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+        )
+
+with st.expander("📦 Importer plusieurs fiches"):
+    import_en_lot()
 
 if uploaded_json is not None and not st.session_state.file_processed:
+    # Read once, then released: the fiche lives on in the form fields
+    reset_uploader('fiche_upload')
     try:
-        # Load the JSON content with proper UTF-8 encoding
-        content = uploaded_json.read().decode('utf-8-sig')
-        saved_data = json.loads(content)        # Validate required fields (excluding nom_client for backward compatibility)
-        required_fields = ['date', 'adresse', 'conducteur', 'chef_chantier', 'contact_chantier']
-        missing_fields = [field for field in required_fields if field not in saved_data]
-        if missing_fields:
-            st.error(f"❌ Champs requis manquants dans le fichier : {', '.join(missing_fields)}")
-            st.stop()
-              # Handle nom_client field for backward compatibility
-        if 'nom_client' not in saved_data:
-            saved_data['nom_client'] = ''  # Set empty string for older files
-            st.session_state['nom_client'] = ''  # Ensure it's set in session state
-            
-        # Convert date string to datetime.date object
-        if 'date' in saved_data:
-            try:
-                date_str = saved_data['date']
-                parsed_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                st.session_state['date'] = parsed_date
-            except ValueError:
-                st.error("❌ Format de date invalide dans le fichier")
-                st.stop()
-                  # Set all basic form fields from saved data        
-        basic_fields = [
-            'nom_client', 'heure', 'adresse', 'presence_sst', 'effectif', 'conducteur',
-            'chef_chantier', 'contact_chantier', 'redacteur_rapport', 'travaux_selectionnes',
-            'travaux_autres', 'theme_visite', 'evaluation_generale', 'lien_photos'
-        ]
-        for field in basic_fields:
-            if field in saved_data:
-                st.session_state[field] = saved_data[field]
-        
-        # Set criteria evaluations and observations
-        for cat in ['Administratif', 'Sécurité', 'Environnement']:
-            for key, value in saved_data.items():
-                if key.startswith(f"{cat}_") or key.startswith(f"obs_{cat}_"):
-                    st.session_state[key] = value
-                    
-        # Show summary of loaded data
-        loaded_fields = len([k for k in saved_data.keys() if saved_data[k]])
+        if uploaded_json.size > MAX_FICHE_BYTES:
+            raise FicheError("Fichier trop volumineux pour une fiche")
+        # Load the JSON content with proper UTF-8 encoding and validate it
+        with span('load', source='upload'):
+            saved_data = parse_fiche(uploaded_json.read())
+            load_fiche_into_state(saved_data)
+        # An uploaded file is saved as a new visit
+        st.session_state.pop('visit_id', None)
         st.session_state.file_processed = True
-        st.success(f"✅ Fiche chargée avec succès ! - Date de visite : {saved_data['date']} - Adresse : {saved_data['adresse']} - {loaded_fields} champs chargés au total")
         
         st.rerun()
         
     except json.JSONDecodeError:
         st.error("""❌ Le fichier n'est pas un fichier JSON valide. 
         Assurez-vous que le fichier a été généré par cette application.""")
+    except FicheError as e:
+        st.error(f"❌ {e}")
+        st.stop()
     except ValueError as e:
         st.error(f"❌ Format de données invalide : {str(e)}")
     except Exception as e:
@@ -169,44 +326,75 @@ if uploaded_json is not None and not st.session_state.file_processed:
 if uploaded_json is None:
     st.session_state.file_processed = False
 
-st.title("🏗️ Rapport de Visite – BR CONSULT")
+# Notes par catégorie, recalculées seulement quand une évaluation change
+if 'notes_finales' not in st.session_state:
+    with span('score'):
+        st.session_state['notes_finales'] = compute_scores(category_notes(st.session_state, categories))[0]
 
-st.subheader("🧱 Informations générales")
+def on_evaluation_change(categorie):
+    with span('score', categorie=categorie):
+        notes = [st.session_state[critere.eval_key] for critere in CATALOGUE.by_category[categorie]]
+        # A new dict: a queued PDF job keeps the scores it was submitted with
+        st.session_state['notes_finales'] = {**st.session_state['notes_finales'], categorie: category_score(notes)}
+    st.session_state['scores_changed'] = True
 
-col1, col2 = st.columns(2)
+def required_fields_filled():
+    return check_required_fields(st.session_state['adresse'], st.session_state['conducteur'],
+                                 st.session_state['chef_chantier'], st.session_state['contact_chantier'],
+                                 st.session_state['redacteur_rapport'])
 
-with col1:
-    st.date_input("Date de la visite", key='date')
-    st.text_input("Nom du client*", key='nom_client')
-    st.text_input("Adresse du chantier*", key='adresse')
+# Full runs already redraw everything below the form
+st.session_state.pop('scores_changed', None)
+st.session_state['required_filled'] = required_fields_filled()
 
-with col2:
-    st.text_input("Heure de la visite (format HH:MM)", 
-                  placeholder="08:30", 
-                  key='heure')
-    
-    if st.session_state['heure'] and not re.match(r"^\d{2}:\d{2}$", st.session_state['heure']):
-        st.warning("⏰ Merci d'utiliser le format HH:MM, par exemple 14:45.")
+st.title("🏗️ Rapport de Visite – BR CONSULT")
 
-st.radio("Présence de sous-traitant :", 
-         ["Oui", "Non"], 
-         horizontal=True,
-         key='presence_sst')
+# Each section of the form is a fragment: editing a field only reruns its own section
+@st.fragment
+def informations_generales():
+    st.subheader("🧱 Informations générales")
 
-st.number_input("Effectif sur site", 
-                min_value=0, 
-                step=1, 
-                format="%d", 
-                help="Nombre d'ouvriers présents sur le chantier",
-                key='effectif')
+    col1, col2 = st.columns(2)
 
-st.text_input("Conducteur de travaux*", key='conducteur')
-st.text_input("Chef de chantier*", key='chef_chantier')
-st.text_input("Contact chantier*", key='contact_chantier')
-st.text_input("Rédacteur du rapport*", key='redacteur_rapport')
+    with col1:
+        st.date_input("Date de la visite", key='date')
+        st.text_input("Nom du client*", key='nom_client')
+        st.text_input("Adresse du chantier*", key='adresse')
+
+    with col2:
+        st.text_input("Heure de la visite (format HH:MM)", 
+                      placeholder="08:30", 
+                      key='heure')
+        
+        if st.session_state['heure'] and not re.match(r"^\d{2}:\d{2}$", st.session_state['heure']):
+            st.warning("⏰ Merci d'utiliser le format HH:MM, par exemple 14:45.")
+
+    st.radio("Présence de sous-traitant :", 
+             ["Oui", "Non"], 
+             horizontal=True,
+             key='presence_sst')
+
+    st.number_input("Effectif sur site", 
+                    min_value=0, 
+                    step=1, 
+                    format="%d", 
+                    help="Nombre d'ouvriers présents sur le chantier",
+                    key='effectif')
+
+    st.text_input("Conducteur de travaux*", key='conducteur')
+    st.text_input("Chef de chantier*", key='chef_chantier')
+    st.text_input("Contact chantier*", key='contact_chantier')
+    st.text_input("Rédacteur du rapport*", key='redacteur_rapport')
+
+    autosave_brouillon()
+
+    # The save and PDF sections depend on the required fields
+    filled = required_fields_filled()
+    if filled != st.session_state['required_filled']:
+        st.session_state['required_filled'] = filled
+        st.rerun()
 
-# Type de travaux
-st.subheader("🔨 Type de travaux")
+informations_generales()
 
 travaux_types = [
     "Ravalement", "Gros œuvre", "Maçonnerie", "Décapage", "Serrurerie", "Ponçage", "Carrelage",
@@ -214,118 +402,166 @@ travaux_types = [
     "ITE", "Peinture", "Bardage", "Zinguerie", "Piochage"
 ]
 
-st.multiselect(
-    "Sélectionnez les travaux effectués :", 
-    travaux_types,
-    key='travaux_selectionnes'
-)
+@st.fragment
+def travaux_et_theme():
+    # Type de travaux
+    st.subheader("🔨 Type de travaux")
 
-st.text_input("Autres travaux (si non listés)", key='travaux_autres')
+    st.multiselect(
+        "Sélectionnez les travaux effectués :", 
+        travaux_types,
+        key='travaux_selectionnes'
+    )
 
-# Thématique de la visite + évaluation générale
-st.subheader("📌 Thème de la visite")
-st.text_input("Quel est le thème principal de cette visite ?", key='theme_visite')
+    st.text_input("Autres travaux (si non listés)", key='travaux_autres')
 
-st.subheader("📝 Évaluation générale du chantier")
-st.text_area(
-    "Commentaires et observations générales sur l'état du chantier",
-    height=200,
-    placeholder="Rédigez ici vos remarques générales : sécurité, ambiance, organisation…",
-    key='evaluation_generale'
-)
+    # Thématique de la visite + évaluation générale
+    st.subheader("📌 Thème de la visite")
+    st.text_input("Quel est le thème principal de cette visite ?", key='theme_visite')
+
+    st.subheader("📝 Évaluation générale du chantier")
+    st.text_area(
+        "Commentaires et observations générales sur l'état du chantier",
+        height=200,
+        placeholder="Rédigez ici vos remarques générales : sécurité, ambiance, organisation…",
+        key='evaluation_generale'
+    )
+    autosave_brouillon()
+
+travaux_et_theme()
 
 # Fonction gestion critères d'évaluation
-def afficher_critere(categorie, nom_critere):
+def afficher_critere(critere):
     col1, col2 = st.columns([1, 2])
     with col1:
         options = ["Non Applicable", "Non Satisfaisant", "Partiellement Satisfaisant", "Satisfaisant"]
         st.selectbox(
-            f"{nom_critere}",
+            critere.label,
             options,
-            key=f"{categorie}_{nom_critere}"
+            key=critere.eval_key,
+            on_change=on_evaluation_change,
+            args=(critere.category,)
         )
     with col2:
         st.text_input(f"Observations", 
-                      key=f"obs_{categorie}_{nom_critere}")
+                      key=critere.obs_key)
+
+@st.fragment
+def evaluation_categorie(categorie):
+    st.markdown(f"### 🔹 {categorie}")
+    for critere in CATALOGUE.by_category[categorie]:
+        afficher_critere(critere)
+    autosave_brouillon()
+    # A new evaluation changes the results panel: rerun the whole page
+    if st.session_state.pop('scores_changed', False):
+        st.rerun()
 
-# Afficher les critères dynamiquement et stocker les notes
+# Afficher les critères dynamiquement
 st.subheader("🧪 Évaluation par critère")
 
-# Stockage des notes
-notes_par_categorie = {}
-
-for cat, criteres in categories.items():
-    st.markdown(f"### 🔹 {cat}")
-    notes = []
-    for crit in criteres:
-        afficher_critere(cat, crit)
-        note = st.session_state.get(f"{cat}_{crit}", "Non Applicable")
-        notes.append(note)
-    notes_par_categorie[cat] = notes
-
-# Pondérations par catégorie
-pondérations = {
-    "Administratif": 0.5,
-    "Sécurité": 3,
-    "Environnement": 1
-}
-
-# Valeurs pondérées des notes
-valeurs = {
-    "Satisfaisant": 1,
-    "Partiellement Satisfaisant": 2/3,
-    "Non Satisfaisant": 1/3,
-    "Non Applicable": None
-}
-
-notes_finales = {}
-note_globale_pondérée = 0
-somme_pondérations = 0
-
-for cat, notes in notes_par_categorie.items():
-    total = 0
-    count = 0
-    for note in notes:
-        valeur = valeurs.get(note)
-        if valeur is not None:
-            total += valeur
-            count += 1
-    if count > 0:
-        moyenne = total / count
-        note_pourcentage = round(moyenne * 100)
-        notes_finales[cat] = note_pourcentage
-        note_globale_pondérée += note_pourcentage * pondérations[cat]
-        somme_pondérations += pondérations[cat]
-    else:
-        notes_finales[cat] = "NA"
-
-# Calcul de la note chantier
-if somme_pondérations > 0:
-    note_chantier = round(note_globale_pondérée / somme_pondérations, 1)
-else:
-    note_chantier = "NA"
+for cat in categories:
+    evaluation_categorie(cat)
+
+notes_finales = st.session_state['notes_finales']
+note_chantier = global_score(notes_finales)
+
+# Miniatures des photos, générées en arrière-plan et partagées entre les sessions
+@st.cache_resource
+def get_thumbnail_pool():
+    return ThumbnailPool()
+
+thumbnail_pool = get_thumbnail_pool()
+
+MAX_PHOTOS = int(os.environ.get('BR_MAX_PHOTOS', '60'))
+
+def photo_entries():
+    # (name, content digest, spooled file) of the photos added to the report
+    return [(photo.name, photo.digest, photo) for photo in st.session_state.get('photo_files', [])]
+
+def submit_thumbnails(entries):
+    return [(name, thumbnail_pool.submit(content_digest, photo.read)) for name, content_digest, photo in entries]
+
+def add_photos(files):
+    photos = st.session_state.setdefault('photo_files', [])
+    known = {photo.digest for photo in photos}
+    for photo in spool_uploads('photos', files):
+        if photo.digest in known:
+            session_uploads().release(photo)
+        elif len(photos) >= MAX_PHOTOS:
+            session_uploads().release(photo)
+            st.session_state['photos_errors'].append(f"« {photo.name} » non ajoutée : {MAX_PHOTOS} photos au maximum")
+        else:
+            photos.append(photo)
+            known.add(photo.digest)
+
+def remove_photos():
+    for photo in st.session_state.pop('photo_files', []):
+        session_uploads().release(photo)
+
+@st.fragment(run_every=1)
+def thumbnails_progress(total):
+    ready = sum(future.done() for _, future in submit_thumbnails(photo_entries()))
+    st.progress(ready / total, text=f"Préparation des miniatures… {ready}/{total}")
+    if ready == total:
+        st.rerun()
 
 # Section Photos du chantier - NOUVEAU
-st.subheader("📸 Photos du chantier")
-st.text_input(
-    "Lien Dropbox vers les photos du chantier", 
-    placeholder="https://www.dropbox.com/sh/...",
-    help="Collez ici le lien de partage Dropbox contenant toutes les photos du chantier",
-    key='lien_photos'
-)
+@st.fragment
+def photos_chantier():
+    st.subheader("📸 Photos du chantier")
+    st.text_input(
+        "Lien Dropbox vers les photos du chantier", 
+        placeholder="https://www.dropbox.com/sh/...",
+        help="Collez ici le lien de partage Dropbox contenant toutes les photos du chantier",
+        key='lien_photos'
+    )
+    nouvelles = st.file_uploader(
+        "Ajouter des photos au rapport (planche photos)",
+        type=['jpg', 'jpeg', 'png', 'webp'],
+        accept_multiple_files=True,
+        key=uploader_key('photos')
+    )
+    if nouvelles:
+        add_photos(nouvelles)
+        st.rerun(scope="fragment")
+    show_upload_errors('photos')
+    if st.session_state.get('photo_files'):
+        thumbnails = submit_thumbnails(photo_entries())
+        done = [(name, future) for name, future in thumbnails if future.done()]
+        columns = st.columns(6)
+        for index, (name, future) in enumerate(done):
+            with columns[index % 6]:
+                if future.exception() is None:
+                    st.image(future.result(), caption=name, width="stretch")
+                else:
+                    st.caption(f"⚠️ {name} illisible")
+        if len(done) < len(thumbnails):
+            thumbnails_progress(len(thumbnails))
+        st.caption(f"{len(thumbnails)}/{MAX_PHOTOS} photo(s). Les photos sont ajoutées au PDF "
+                   "mais ne sont pas enregistrées dans la fiche JSON.")
+        if st.button("🗑️ Retirer les photos"):
+            remove_photos()
+            st.rerun(scope="fragment")
+    autosave_brouillon()
+
+photos_chantier()
 
 # Affichage des résultats
-st.subheader("📊 Résultat de l'évaluation")
+@st.fragment
+def resultats():
+    st.subheader("📊 Résultat de l'évaluation")
 
-for cat, note in notes_finales.items():
-    if isinstance(note, int):
-        st.progress(note / 100)
-        st.write(f"**{cat}** : {note}%")
-    else:
-        st.write(f"**{cat}** : NA")
+    for cat, note in notes_finales.items():
+        if isinstance(note, int):
+            st.progress(note / 100)
+            st.write(f"**{cat}** : {note}%")
+        else:
+            st.write(f"**{cat}** : NA")
+
+    st.markdown("---")
+    st.markdown(f"### 🧮 **Note globale du chantier : {note_chantier}%**")
 
-st.markdown("---")
-st.markdown(f"### 🧮 **Note globale du chantier : {note_chantier}%**")
+resultats()
 
 # Ajout feuille d'émargement
 st.subheader("📝 Feuille d'émargement")
@@ -333,822 +569,375 @@ st.subheader("📝 Feuille d'émargement")
 emargement = st.file_uploader(
     "Ajoutez une photo ou scan de la feuille d'émargement",
     type=["jpg", "jpeg", "png", "pdf"],
-    key="emargement"
+    key=uploader_key('emargement')
 )
-
 if emargement:
-    if emargement.type != "application/pdf":
-        st.image(emargement, width=300)
+    spooled = spool_uploads('emargement', [emargement])
+    if spooled:
+        if 'emargement_file' in st.session_state:
+            session_uploads().release(st.session_state['emargement_file'])
+        st.session_state['emargement_file'] = spooled[0]
+    st.rerun()
+show_upload_errors('emargement')
+
+feuille = st.session_state.get('emargement_file')
+if feuille:
+    if feuille.type != "application/pdf":
+        # Screen-sized thumbnail rather than the full scan
+        try:
+            st.image(thumbnail_pool.submit(feuille.digest, feuille.read).result(), width=300)
+        except Exception:
+            st.warning(f"⚠️ {feuille.name} illisible")
     else:
         st.info("PDF chargé. Il sera inclus dans le rapport final.")
+    if st.button("🗑️ Retirer la feuille d'émargement"):
+        session_uploads().release(st.session_state.pop('emargement_file'))
+        st.rerun()
 
-# Configuration pour la génération PDF
-def configure_wkhtmltopdf():
-    # On Streamlit Cloud, wkhtmltopdf is installed via packages.txt
-    if os.path.exists('/usr/bin/wkhtmltopdf'):
-        return pdfkit.configuration(wkhtmltopdf='/usr/bin/wkhtmltopdf')
+# Pool de rendu PDF partagé entre toutes les sessions
+@st.cache_resource
+def get_render_pool():
+    return RenderPool(get_engine())
+
+render_pool = get_render_pool()
+pdf_engine = render_pool.engine
+if not pdf_engine.available:
+    st.warning(f"Note: PDF generation is unavailable – {pdf_engine.unavailable_message}")
+
+# Cache des PDF générés, en mémoire et optionnellement sur disque
+@st.cache_resource
+def get_pdf_cache():
+    return PdfCache(disk_dir=os.environ.get('BR_PDF_CACHE_DIR') or None)
+
+pdf_cache = get_pdf_cache()
+
+# Jobs de génération PDF en arrière-plan, partagés entre les sessions
+@st.cache_resource
+def get_pdf_jobs():
+    return JobManager(workers=render_pool.size * 2)
+
+pdf_jobs = get_pdf_jobs()
+
+# Endpoint Prometheus /metrics, démarré une seule fois par processus
+@st.cache_resource
+def get_metrics_server():
+    return serve_metrics()
+
+get_metrics_server()
+REGISTRY.gauge('br_pdf_render_queue_depth', "Rendus PDF en attente d'un moteur.",
+               lambda: render_pool.stats()['queue_depth'])
+REGISTRY.gauge('br_pdf_renders_in_flight', "Rendus PDF en cours.",
+               lambda: render_pool.stats()['in_flight'])
+REGISTRY.gauge('br_pdf_cache_bytes', "Taille du cache PDF en mémoire.",
+               lambda: pdf_cache.stats()['bytes'])
+
+# Données de la fiche telles qu'elles sont sauvegardées
+def collect_save_data():
+    save_data = {
+        'date': str(st.session_state['date']),
+        'heure': st.session_state['heure'],
+        'nom_client': st.session_state['nom_client'],
+        'adresse': st.session_state['adresse'],
+        'presence_sst': st.session_state['presence_sst'],
+        'effectif': st.session_state['effectif'],
+        'conducteur': st.session_state['conducteur'],
+        'chef_chantier': st.session_state['chef_chantier'],
+        'contact_chantier': st.session_state['contact_chantier'],
+        'redacteur_rapport': st.session_state['redacteur_rapport'],
+        'travaux_selectionnes': st.session_state['travaux_selectionnes'],
+        'travaux_autres': st.session_state['travaux_autres'],
+        'theme_visite': st.session_state['theme_visite'],
+        'evaluation_generale': st.session_state['evaluation_generale'],
+        'lien_photos': st.session_state['lien_photos'],
+        'note_chantier': note_chantier if isinstance(note_chantier, (int, float)) else "NA",
+        'catalogue_version': CATALOGUE.version
+    }
     
-    # For Windows local development
-    if platform.system() == 'Windows':
-        windows_paths = [
-            r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe',
-            r'C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe'
-        ]
-        for path in windows_paths:
-            if os.path.exists(path):
-                return pdfkit.configuration(wkhtmltopdf=path)
-    
-    # Default configuration
-    try:
-        return pdfkit.configuration()
-    except Exception as e:
-        st.warning("Note: PDF generation requires wkhtmltopdf to be installed")
-        return None
-
-# Initialize wkhtmltopdf configuration
-config = configure_wkhtmltopdf()
+    for critere in CATALOGUE.criteria:
+        save_data[critere.eval_key] = st.session_state[critere.eval_key]
+        save_data[critere.obs_key] = st.session_state[critere.obs_key]
+    return save_data
 
 st.subheader("💾 Sauvegarde de l'avancement")
 
 # Bouton de sauvegarde
 if st.button("💾 Sauvegarder l'avancement"):
-    if not check_required_fields(st.session_state['adresse'], st.session_state['conducteur'], 
-            st.session_state['chef_chantier'], st.session_state['contact_chantier'],
-            st.session_state['redacteur_rapport']):
+    if not required_fields_filled():
         st.error("❌ Veuillez remplir tous les champs obligatoires (*) avant de sauvegarder")
         st.stop()
         
     try:
-        save_data = {
-            'date': str(st.session_state['date']),
-            'heure': st.session_state['heure'],
-            'nom_client': st.session_state['nom_client'],
-            'adresse': st.session_state['adresse'],
-            'presence_sst': st.session_state['presence_sst'],
-            'effectif': st.session_state['effectif'],
-            'conducteur': st.session_state['conducteur'],
-            'chef_chantier': st.session_state['chef_chantier'],
-            'contact_chantier': st.session_state['contact_chantier'],
-            'redacteur_rapport': st.session_state['redacteur_rapport'],
-            'travaux_selectionnes': st.session_state['travaux_selectionnes'],
-            'travaux_autres': st.session_state['travaux_autres'],
-            'theme_visite': st.session_state['theme_visite'],
-            'evaluation_generale': st.session_state['evaluation_generale'],
-            'lien_photos': st.session_state['lien_photos'],
-            'note_chantier': note_chantier if isinstance(note_chantier, (int, float)) else "NA"
-        }
-        
-        for cat in ['Administratif', 'Sécurité', 'Environnement']:
-            for critere in categories[cat]:
-                eval_key = f"{cat}_{critere}"
-                obs_key = f"obs_{cat}_{critere}"
-                save_data[eval_key] = st.session_state[eval_key]
-                save_data[obs_key] = st.session_state[obs_key]
+        save_data = collect_save_data()
+        st.session_state['visit_id'] = visit_store.save(save_data, st.session_state.get('visit_id'))
+        # The visit is saved: its draft is no longer needed
+        if 'draft_id' in st.session_state:
+            draft_writer.discard(st.session_state.pop('draft_id'))
+            st.query_params.pop('brouillon', None)
 
         now = datetime.now()
-        filename = f"visite_chantier_{now.strftime('%Y%m%d_%H%M%S')}.json"
-        json_str = json.dumps(save_data, ensure_ascii=False, indent=2)
-        json_bytes = json_str.encode('utf-8-sig')
+        filename = f"visite_chantier_{now.strftime('%Y%m%d_%H%M%S')}.json" + (".gz" if FICHE_GZIP else "")
+        json_bytes = encode_fiche(save_data, compact=FICHE_COMPACT, compress=FICHE_GZIP)
         
         st.download_button(
             label="📥 Télécharger la fiche",
             data=json_bytes,
             file_name=filename,
-            mime="application/json",
+            mime="application/gzip" if FICHE_GZIP else "application/json",
         )
         
-        st.success("✅ Données sauvegardées avec succès ! Cliquez sur le bouton ci-dessus pour télécharger le fichier.")
+        st.success("✅ Données sauvegardées avec succès sur le serveur ! Cliquez sur le bouton ci-dessus pour télécharger une copie du fichier.")
         
     except Exception as e:
         st.error(f"❌ Erreur lors de la sauvegarde : {str(e)}")
 
 st.subheader("📄 Export PDF")
 
+# Aperçu : le HTML du rapport affiché par le navigateur, sans passer par le moteur PDF
+def emargement_preview(feuille):
+    if feuille is None or not feuille.type.startswith("image"):
+        return None
+    cached = st.session_state.get('apercu_emargement')
+    if cached and cached[0] == feuille.digest:
+        return cached[1]
+    # Screen resolution is enough for the preview
+    encoded = prepared_base64(feuille.digest, feuille.read(), dpi=CSS_DPI)
+    st.session_state['apercu_emargement'] = (feuille.digest, encoded)
+    return encoded
+
+@st.fragment(run_every=3)
+def apercu_rapport():
+    # Polled, since edits in the other sections do not rerun this fragment. The
+    # HTML is only rebuilt when the fiche changed; an identical report is sent
+    # as a reference to the copy the browser already holds (ForwardMsg cache).
+    feuille = st.session_state.get('emargement_file')
+    data = collect_save_data()
+    version = (digest(json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)),
+               feuille.digest if feuille else None)
+    cached = st.session_state.get('apercu_html')
+    if cached is not None and cached[0] == version:
+        html = cached[1]
+    else:
+        notes = st.session_state['notes_finales']
+        with span('preview'):
+            html = build_report_html(
+                data,
+                notes,
+                global_score(notes),
+                categories,
+                logo_base64=LOGO_BR_BASE64,
+                emargement_base64=emargement_preview(feuille),
+                emargement_pdf=feuille is not None and feuille.type == "application/pdf",
+                preview=True
+            )
+        st.session_state['apercu_html'] = (version, html)
+    # The contact sheet would add every thumbnail to each refresh; it is only in the PDF
+    if st.session_state.get('photo_files'):
+        st.caption(f"📸 Planche photos ({len(st.session_state['photo_files'])} photo(s)) non affichée dans l'aperçu.")
+    # Fiche values are escaped by the template
+    if hasattr(st, 'iframe'):
+        st.iframe(html, height=900)
+    else:
+        components.html(html, height=900, scrolling=True)
+
+if st.toggle("👁️ Aperçu du rapport", key='apercu', help="Affiche le rapport tel qu'il sera imprimé, sans générer le PDF"):
+    apercu_rapport()
+
+# Génération complète d'un rapport, exécutée en arrière-plan
+def generate_report_pdf(job, report_data, notes_finales, note_chantier, feuille_type, feuille_data, feuille_digest,
+                        thumbnails=()):
+    job.stage = 'html'
+    emargement_base64 = None
+    if feuille_type and feuille_type.startswith("image"):
+        with span('emargement', job=job.id, bytes=len(feuille_data)):
+            emargement_base64 = prepared_base64(feuille_digest, feuille_data, dpi=PDF_OPTIONS['dpi'])
+    photos = []
+    with span('photos', job=job.id, photos=len(thumbnails)):
+        for name, future in thumbnails:
+            try:
+                photos.append((name, base64.b64encode(future.result()).decode()))
+            except Exception as e:
+                # An unreadable photo is left out rather than failing the report
+                print(f"Photo {name} ignorée : {e}")
+    with span('html', job=job.id):
+        html = build_report_html(
+            report_data,
+            notes_finales,
+            note_chantier,
+            categories,
+            logo_base64=LOGO_BR_BASE64,
+            emargement_base64=emargement_base64,
+            emargement_pdf=feuille_type == "application/pdf",
+            photos=photos
+        )
+    job.stage = 'render'
+    try:
+        with span('render', job=job.id, engine=pdf_engine.name, html_bytes=len(html)):
+            pdf_bytes = render_pool.render(html)
+    except Exception:
+        PDF_RENDER_FAILURES.inc()
+        raise
+    PDF_RENDERS.inc()
+    if feuille_type == "application/pdf":
+        job.stage = 'merge'
+        with span('merge', job=job.id):
+            pdf_bytes = append_pdf(pdf_bytes, io.BytesIO(feuille_data))
+    pdf_cache.put(job.id, pdf_bytes)
+    return pdf_bytes
+
+def show_pdf_job(job):
+    if job.stage == 'done':
+        with span('download', job=job.id, bytes=len(job.result)):
+            st.download_button(
+                label="📥 Télécharger le PDF",
+                data=job.result,
+                file_name=job.meta['file_name'],
+                mime="application/pdf",
+                key=f"download_{job.id}"
+            )
+        st.success("✅ PDF généré avec succès !")
+        if job.from_cache:
+            st.caption("⚡ Rapport inchangé, PDF servi depuis le cache")
+        else:
+            stats = render_pool.stats()
+            st.caption(
+                f"⚙️ Rendu en {job.elapsed():.1f}s – "
+                f"{stats['pool_size']} moteur(s) PDF, {stats['in_flight']} en cours, {stats['queue_depth']} en attente"
+            )
+    elif job.stage == 'failed':
+        st.error(f"❌ Erreur lors de la génération du PDF : {job.error}")
+    else:
+        # No real progress is reported by wkhtmltopdf: estimate from recent render times
+        expected = render_pool.stats().get('p50_latency') or 10
+        progress = min(0.95, job.elapsed() / (expected * 1.2))
+        st.progress(progress, text=f"⏳ {STAGES[job.stage]}… ({job.elapsed():.0f}s)")
+        st.caption("Vous pouvez continuer à modifier la fiche, le PDF sera prêt ici.")
+
+@st.fragment(run_every=1)
+def pdf_job_progress(state_key='pdf_job_id'):
+    job = pdf_jobs.get(st.session_state.get(state_key))
+    if job is None:
+        return
+    show_pdf_job(job)
+    if job.finished:
+        # Leave polling mode once the job is over
+        st.rerun()
+
 # Add validation before allowing PDF generation
-if not check_required_fields(st.session_state['adresse'], st.session_state['conducteur'], 
-                            st.session_state['chef_chantier'], st.session_state['contact_chantier'],
-                            st.session_state['redacteur_rapport']):
+if not required_fields_filled():
     st.warning("⚠️ Merci de remplir tous les champs obligatoires marqués par une astérisque.")
 else:
     if st.button("📤 Générer le PDF"):
         current_date = datetime.now().strftime("%d-%m-%Y")
-        
-        # Enhanced HTML with BR CONSULT branding and page breaks
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;600;700&family=Open+Sans:wght@300;400;600&display=swap');
-                
-                * {{
-                    margin: 0;
-                    padding: 0;
-                    box-sizing: border-box;
-                }}
-                
-                @page {{
-                    size: A4;
-                    margin: 5mm 5mm 5mm 5mm;
-                }}
-                
-                body {{
-                    font-family: 'Open Sans', Arial, sans-serif;
-                    line-height: 1.6;
-                    color: #2c2c2c;
-                    background: #ffffff;
-                    width: 100%;
-                    margin: 0;
-                    padding: 0;
-                }}
-                
-                .container {{
-                    width: 100%;
-                    margin: 0 auto;
-                    background: white;
-                    padding: 0;
-                }}
-                
-                /* Wrapper for page content with borders */
-                .page-wrapper {{
-                    border: 2px solid #dc2626;
-                    border-radius: 8px;
-                    margin: 5mm;
-                    padding: 15px;
-                    min-height: calc(297mm - 20mm);
-                    position: relative;
-                    page-break-inside: avoid;
-                    page-break-after: always;
-                }}
-                
-                .page-wrapper:last-child {{
-                    page-break-after: avoid;
-                }}
-                
-                /* Header with title for first page only */
-                .header-with-title {{
-                    background: #ffffff;
-                    color: #000000;
-                    padding: 15px 30px 20px 30px;
-                    position: relative;
-                    min-height: 120px;
-                    margin: -15px -15px 20px -15px;
-                    border-bottom: 3px solid #dc2626;
-                    border-radius: 6px 6px 0 0;
-                }}
-                
-                /* Header with logo only for other pages */
-                .header-logo-only {{
-                    position: absolute;
-                    top: 15px;
-                    left: 30px;
-                    z-index: 10;
-                }}
-                
-                .logo-container {{
-                    position: absolute;
-                    left: 30px;
-                    top: 15px;
-                }}
-                
-                .logo-container img {{
-                    width: 60px;
-                    height: auto;
-                    display: block;
-                }}
-                
-                .page-title {{
-                    font-family: 'Montserrat', sans-serif;
-                    font-size: 2em;
-                    font-weight: 700;
-                    letter-spacing: 1px;
-                    color: #000000;
-                    text-transform: uppercase;
-                    text-align: center;
-                    padding-top: 60px;
-                }}
-                
-                /* Content sections */
-                .content {{
-                    padding: 0 10px;
-                }}
-                
-                .content-with-logo {{
-                    padding: 80px 10px 10px 10px;
-                }}
-                
-                .section {{
-                    margin-bottom: 15px;
-                    padding: 15px;
-                    background: #fafafa;
-                    border-radius: 6px;
-                    border: 1px solid #e5e5e5;
-                    position: relative;
-                    page-break-inside: avoid;
-                }}
-                
-                .section::before {{
-                    content: '';
-                    position: absolute;
-                    left: 0;
-                    top: 0;
-                    bottom: 0;
-                    width: 3px;
-                    background: #dc2626;
-                    border-radius: 6px 0 0 6px;
-                }}
-                
-                .section-title {{
-                    color: #000000;
-                    font-family: 'Montserrat', sans-serif;
-                    font-size: 1.4em;
-                    font-weight: 600;
-                    margin-bottom: 20px;
-                    padding-bottom: 10px;
-                    border-bottom: 2px solid #dc2626;
-                    display: flex;
-                    align-items: center;
-                }}
-                
-                .icon {{
-                    margin-right: 10px;
-                    font-size: 1em;
-                    color: #dc2626;
-                }}
-                
-                /* Info grid */
-                .info-grid {{
-                    display: grid;
-                    grid-template-columns: repeat(2, 1fr);
-                    gap: 15px;
-                    margin-bottom: 15px;
-                }}
-                
-                .info-item {{
-                    padding: 12px;
-                    background: white;
-                    border-radius: 5px;
-                    border: 1px solid #e5e5e5;
-                }}
-                
-                .info-label {{
-                    font-weight: 600;
-                    color: #666666;
-                    font-size: 0.8em;
-                    text-transform: uppercase;
-                    letter-spacing: 0.5px;
-                    margin-bottom: 4px;
-                }}
-                
-                .info-value {{
-                    color: #000000;
-                    font-size: 1em;
-                    font-weight: 500;
-                }}
-                
-                /* Photos link section */
-                .photos-link-box {{
-                    background: #e3f2fd;
-                    border: 2px solid #1976d2;
-                    border-radius: 6px;
-                    padding: 15px;
-                    margin: 15px 0;
-                    text-align: center;
-                }}
-                
-                .photos-link-box a {{
-                    color: #1976d2;
-                    font-weight: 600;
-                    text-decoration: none;
-                    font-size: 0.85em;
-                    word-break: break-all;
-                    display: inline-block;
-                    max-width: 100%;
-                }}
-                
-                /* Results presentation style */
-                .results-grid {{
-                    display: grid;
-                    grid-template-columns: repeat(3, 1fr);
-                    gap: 20px;
-                    margin: 20px 0;
-                    text-align: center;
-                }}
-                
-                .result-item {{
-                    padding: 25px 15px;
-                    background: white;
-                    border-radius: 6px;
-                    border: 2px solid #e5e5e5;
-                }}
-                
-                .result-category {{
-                    font-family: 'Montserrat', sans-serif;
-                    font-size: 0.95em;
-                    font-weight: 700;
-                    text-transform: uppercase;
-                    letter-spacing: 0.8px;
-                    color: #2c2c2c;
-                    margin-bottom: 10px;
-                }}
-                
-                .result-score {{
-                    font-family: 'Montserrat', sans-serif;
-                    font-size: 2.8em;
-                    font-weight: 700;
-                    color: #dc2626;
-                    line-height: 1;
-                }}
-                
-                /* Global score - BR CONSULT style */
-                .global-score {{
-                    text-align: center;
-                    padding: 30px;
-                    background: #000000;
-                    color: white;
-                    border-radius: 8px;
-                    margin: 30px 0;
-                    position: relative;
-                }}
-                
-                .score-value {{
-                    font-family: 'Montserrat', sans-serif;
-                    font-size: 3.5em;
-                    font-weight: 700;
-                    margin: 0;
-                    color: white;
-                    display: inline;
-                }}
-                
-                .score-label {{
-                    font-family: 'Open Sans', sans-serif;
-                    font-size: 1.1em;
-                    font-weight: 400;
-                    letter-spacing: 1px;
-                    text-transform: uppercase;
-                    margin-bottom: 15px;
-                }}
-                
-                /* Category headers */
-                .category-header {{
-                    font-family: 'Montserrat', sans-serif;
-                    color: #000000;
-                    margin: 10px 0 10px 0;
-                    font-size: 1.3em;
-                    font-weight: 600;
-                    padding-left: 12px;
-                    border-left: 3px solid #dc2626;
-                }}
-                
-                /* Criteria table - BR CONSULT style */
-                .criteria-table {{
-                    width: 100%;
-                    border-collapse: collapse;
-                    margin-top: 10px;
-                    margin-bottom: 15px;
-                    background: white;
-                    border-radius: 6px;
-                    overflow: hidden;
-                    box-shadow: 0 1px 5px rgba(0,0,0,0.05);
-                }}
-                
-                .criteria-table th {{
-                    background: #2c2c2c;
-                    color: white;
-                    padding: 15px 12px;
-                    text-align: left;
-                    font-weight: 600;
-                    font-size: 0.9em;
-                    letter-spacing: 0.5px;
-                }}
-                
-                .criteria-table th:first-child {{
-                    border-left: 3px solid #dc2626;
-                }}
-                
-                .criteria-table td {{
-                    padding: 12px;
-                    border-bottom: 1px solid #f0f0f0;
-                    background: white;
-                    font-size: 0.9em;
-                }}
-                
-                .criteria-table tr:last-child td {{
-                    border-bottom: none;
-                }}
-                
-                /* Status badges - BR CONSULT style */
-                .status {{
-                    display: inline-block;
-                    padding: 5px 12px;
-                    border-radius: 15px;
-                    font-size: 0.8em;
-                    font-weight: 600;
-                    text-align: center;
-                    min-width: 120px;
-                    letter-spacing: 0.2px;
-                }}
-                
-                .status-satisfaisant {{
-                    background: #dcfce7;
-                    color: #166534;
-                    border: 1px solid #bbf7d0;
-                }}
-                
-                .status-partiellement {{
-                    background: #fef3c7;
-                    color: #92400e;
-                    border: 1px solid #fde68a;
-                }}
-                
-                .status-non-satisfaisant {{
-                    background: #fee2e2;
-                    color: #991b1b;
-                    border: 1px solid #fecaca;
-                }}
-                
-                .status-na {{
-                    background: #f3f4f6;
-                    color: #4b5563;
-                    border: 1px solid #e5e7eb;
-                }}
-                
-                /* Observations */
-                .observation {{
-                    font-style: italic;
-                    color: #6b7280;
-                    font-size: 0.85em;
-                    margin-top: 3px;
-                    line-height: 1.3;
-                }}
-                
-                /* Work types - BR CONSULT style */
-                .work-tags {{
-                    display: flex;
-                    flex-wrap: wrap;
-                    gap: 8px;
-                    margin-top: 12px;
-                }}
-                
-                .work-tag {{
-                    background: #fee2e2;
-                    color: #dc2626;
-                    padding: 6px 15px;
-                    border-radius: 20px;
-                    font-size: 0.85em;
-                    font-weight: 600;
-                    border: 1px solid #fecaca;
-                }}
-                
-                /* Print styles */
-                @media print {{
-                    body {{
-                        background: white;
-                        margin: 0;
-                        padding: 0;
-                    }}
-                    
-                    .page-wrapper {{
-                        border: 2px solid #dc2626;
-                        margin: 5mm;
-                        page-break-inside: avoid;
-                    }}
-                    
-                    .container {{
-                        width: 100%;
-                    }}
-                    
-                    .section {{
-                        page-break-inside: avoid;
-                    }}
-                    
-                    .criteria-table {{
-                        page-break-inside: auto;
-                    }}
-                    
-                    .criteria-table tr {{
-                        page-break-inside: avoid;
-                    }}
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <!-- Page 1 -->
-                <div class="page-wrapper">
-                    <!-- Header with title -->
-                    <div class="header-with-title">
-                        {'''
-                        <div class="logo-container">
-                            <img src="data:image/jpeg;base64,''' + str(LOGO_BR_BASE64) + '''" alt="BR CONSULT Logo" />
-                        </div>
-                        ''' if LOGO_BR_BASE64 else ''}
-                        <div class="page-title">RAPPORT DE VISITE CHANTIER</div>
-                    </div>
-                    
-                    <!-- Content -->
-                    <div class="content">
-                        <!-- General Information -->
-                        <div class="section">
-                            <h2 class="section-title">
-                                <span class="icon">📋</span>
-                                Informations Générales
-                            </h2>
-                            <div class="info-grid">
-                                <div class="info-item">
-                                    <div class="info-label">Nom du client</div>
-                                    <div class="info-value">{st.session_state['nom_client']}</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Date de visite</div>
-                                    <div class="info-value">{st.session_state['date'].strftime('%d/%m/%Y')}</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Heure de visite</div>
-                                    <div class="info-value">{st.session_state['heure'] or 'Non renseignée'}</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Adresse du chantier</div>
-                                    <div class="info-value">{st.session_state['adresse']}</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Effectif sur site</div>
-                                    <div class="info-value">{st.session_state['effectif']} personnes</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Conducteur de travaux</div>
-                                    <div class="info-value">{st.session_state['conducteur']}</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Chef de chantier</div>
-                                    <div class="info-value">{st.session_state['chef_chantier']}</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Contact chantier</div>
-                                    <div class="info-value">{st.session_state['contact_chantier']}</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Rédacteur du rapport</div>
-                                    <div class="info-value">{st.session_state['redacteur_rapport']}</div>
-                                </div>
-                                <div class="info-item">
-                                    <div class="info-label">Présence sous-traitant</div>
-                                    <div class="info-value">{st.session_state['presence_sst']}</div>
-                                </div>
-                            </div>
-                        </div>
-                        
-                        <!-- Work Types -->
-                        <div class="section">
-                            <h2 class="section-title">
-                                <span class="icon">🔨</span>
-                                Type de Travaux
-                            </h2>
-                            <div class="work-tags">
-        """
-        
-        # Add selected works
-        for travail in st.session_state['travaux_selectionnes']:
-            html += f'<span class="work-tag">{travail}</span>'
-        
-        if st.session_state['travaux_autres']:
-            html += f'<span class="work-tag">{st.session_state["travaux_autres"]}</span>'
-        
-        html += f"""
-                            </div>
-                        </div>
-                        
-                        <!-- Visit Theme -->
-                        {f'''
-                        <div class="section">
-                            <h2 class="section-title">
-                                <span class="icon">🎯</span>
-                                Thème de la Visite
-                            </h2>
-                            <p>{st.session_state["theme_visite"] or "Non spécifié"}</p>
-                        </div>
-                        ''' if st.session_state['theme_visite'] else ''}
-                        
-                        <!-- General Evaluation -->
-                        {f'''
-                        <div class="section">
-                            <h2 class="section-title">
-                                <span class="icon">📝</span>
-                                Évaluation Générale
-                            </h2>
-                            <p>{st.session_state["evaluation_generale"] or "Aucune observation générale"}</p>
-                        </div>
-                        ''' if st.session_state['evaluation_generale'] else ''}
-                        
-                        <!-- Photos Link Section -->
-                        {f'''
-                        <div class="section">
-                            <h2 class="section-title">
-                                <span class="icon">📸</span>
-                                Photos du Chantier
-                            </h2>
-                            <div class="photos-link-box">
-                                <p style="margin-bottom: 8px;">Les photos du chantier sont disponibles via le lien suivant :</p>
-                                <a href="{st.session_state["lien_photos"]}" target="_blank">{st.session_state["lien_photos"]}</a>
-                            </div>
-                        </div>
-                        ''' if st.session_state['lien_photos'] else ''}
-                    </div>
-                </div>
-                
-                <!-- Page 2 - Scores -->
-                <div class="page-wrapper">
-                    {'''
-                    <div class="header-logo-only">
-                        <img src="data:image/jpeg;base64,''' + str(LOGO_BR_BASE64) + '''" alt="BR CONSULT Logo" style="width: 60px; height: auto;" />
-                    </div>
-                    ''' if LOGO_BR_BASE64 else ''}
-                    
-                    <div class="content-with-logo">
-                        <div class="section">
-                            <h2 class="section-title">
-                                <span class="icon">📊</span>
-                                Résultats de l'Évaluation
-                            </h2>
-                            <div class="results-grid">
-        """
-        
-        # Add results in grid format
-        for cat, note in notes_finales.items():
-            score_display = f"{note}%" if isinstance(note, int) else "N/A"
-            html += f"""
-                                <div class="result-item">
-                                    <div class="result-category">{cat.upper()}</div>
-                                    <div class="result-score">{score_display}</div>
-                                </div>
-            """
-        
-        html += f"""
-                            </div>
-                            
-                            <!-- Global Score -->
-                            <div class="global-score">
-                                <div class="score-label">Note Globale du Chantier</div>
-                                <div class="score-value">{note_chantier}%</div>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-                
-                <!-- Page 3 - Detailed Criteria -->
-                <div class="page-wrapper">
-                    {'''
-                    <div class="header-logo-only">
-                        <img src="data:image/jpeg;base64,''' + str(LOGO_BR_BASE64) + '''" alt="BR CONSULT Logo" style="width: 60px; height: auto;" />
-                    </div>
-                    ''' if LOGO_BR_BASE64 else ''}
-                    
-                    <div class="content-with-logo">
-                        <div class="section">
-                            <h2 class="section-title">
-                                <span class="icon">🔍</span>
-                                Détail des Critères d'Évaluation
-                            </h2>
-        """
-        
-        # Add detailed criteria for each category
-        for idx, (cat, criteres) in enumerate(categories.items()):
-            # Start a new page for each category except the first one
-            if idx > 0:
-                html += f"""
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="page-wrapper">
-                    {'''
-                    <div class="header-logo-only">
-                        <img src="data:image/jpeg;base64,''' + str(LOGO_BR_BASE64) + '''" alt="BR CONSULT Logo" style="width: 60px; height: auto;" />
-                    </div>
-                    ''' if LOGO_BR_BASE64 else ''}
-                    
-                    <div class="content-with-logo">
-                        <div class="section" style="margin-bottom: 10px;">
-                """
-            
-            html += f"""
-                            <h3 class="category-header" style="margin-top: 10px; margin-bottom: 10px;">{cat}</h3>
-                            <table class="criteria-table">
-                                <thead>
-                                    <tr>
-                                        <th style="width: 40%;">Critère</th>
-                                        <th style="width: 25%;">Évaluation</th>
-                                        <th style="width: 35%;">Observations</th>
-                                    </tr>
-                                </thead>
-                                <tbody>
-            """
-            
-            for crit in criteres:
-                note_key = f"{cat}_{crit}"
-                obs_key = f"obs_{cat}_{crit}"
-                note = st.session_state.get(note_key, "Non noté")
-                obs = st.session_state.get(obs_key, "")
-                
-                # Determine status class
-                status_class = ""
-                if note == "Satisfaisant":
-                    status_class = "status-satisfaisant"
-                elif note == "Partiellement Satisfaisant":
-                    status_class = "status-partiellement"
-                elif note == "Non Satisfaisant":
-                    status_class = "status-non-satisfaisant"
-                else:
-                    status_class = "status-na"
-                
-                html += f"""
-                                    <tr>
-                                        <td>{crit}</td>
-                                        <td><span class="status {status_class}">{note}</span></td>
-                                        <td><span class="observation">{obs if obs else '-'}</span></td>
-                                    </tr>
-                """
-            
-            html += """
-                                </tbody>
-                            </table>
-            """
-            
-            # Add attendance sheet section directly after Environment criteria
-            if cat == "Environnement":
-                html += """
-                            <!-- Attendance Sheet -->
-                            <div style="margin-top: 20px;">
-                                <h2 class="section-title" style="margin-bottom: 15px;">
-                                    <span class="icon">✍️</span>
-                                    Feuille d'Émargement - Sensibilisation
-                                </h2>
-                """
-                
-                feuille = st.session_state.get("emargement")
-                if feuille and feuille.type.startswith("image"):
-                    feuille.seek(0)  # Reset file pointer
-                    img_base64 = base64.b64encode(feuille.read()).decode()
-                    html += f"""
-                                <div style="text-align: center; margin: 15px 0;">
-                                    <img src="data:image/jpeg;base64,{img_base64}" style="max-width: 100%; max-height: 400px; border-radius: 6px; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
-                                </div>
-                    """
-                elif feuille and feuille.type == "application/pdf":
-                    html += """
-                                <p style="text-align: center; padding: 20px; background: #f8f9fa; border-radius: 6px;">
-                                    <span style="font-size: 1.1em;">📎 Un fichier PDF a été joint comme feuille d'émargement</span>
-                                </p>
-                    """
-                else:
-                    html += """
-                                <p style="text-align: center; padding: 20px; background: #f8f9fa; border-radius: 6px; color: #6c757d;">
-                                    Aucune feuille d'émargement ajoutée
-                                </p>
-                    """
-                
-                html += """
-                            </div>
-                """
-        
-        html += """
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </body>
-    </html>
-"""        # Generate PDF
-        if config is None:
-            st.error("PDF generation is not available. Please make sure wkhtmltopdf is installed.")
-            st.stop()
-            
-        try:
+        feuille = st.session_state.get('emargement_file')
+        feuille_data = feuille.read() if feuille else None
+        feuille_digest = feuille.digest if feuille else None
+        feuille_type = feuille.type if feuille else None
+        report_data = collect_save_data()
+        photos = photo_entries()
+        cache_key = report_cache_key(
+            report_data,
+            feuille_digest,
+            LOGO_BR_DIGEST,
+            TEMPLATE_VERSION,
+            pdf_engine.name,
+            [content_digest for _, content_digest, _ in photos]
+        )
+        meta = {'file_name': f"rapport_visite_chantier_{current_date}.pdf"}
+
+        # Identical report already generated or in progress: reuse it
+        job = pdf_jobs.get(cache_key)
+        if job is not None and job.stage != 'failed':
+            PDF_CACHE_HITS.inc(source='job')
+        else:
+            pdf_bytes = pdf_cache.get(cache_key)
+            if pdf_bytes is not None:
+                PDF_CACHE_HITS.inc(source='pdf_cache')
+                job = pdf_jobs.add_finished(cache_key, pdf_bytes, meta)
+            elif not pdf_engine.available:
+                st.error(f"PDF generation is not available: {pdf_engine.unavailable_message}")
+                st.stop()
+            else:
+                PDF_CACHE_MISSES.inc()
+                thumbnails = submit_thumbnails(photos)
+                job = pdf_jobs.submit(
+                    cache_key,
+                    # Scores snapshotted now, like report_data: edits made while queued are not mixed in
+                    lambda job, notes=dict(notes_finales), note=note_chantier: generate_report_pdf(
+                        job, report_data, notes, note,
+                        feuille_type, feuille_data, feuille_digest, thumbnails
+                    ),
+                    meta
+                )
+        st.session_state['pdf_job_id'] = job.id
+
+job = pdf_jobs.get(st.session_state.get('pdf_job_id'))
+if job is not None:
+    if job.finished:
+        show_pdf_job(job)
+    else:
+        pdf_job_progress()
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as f:
-                pdfkit.from_string(html, f.name, configuration=config, options={
-                    'enable-local-file-access': None,
-                    'encoding': 'UTF-8',
-                    'page-size': 'A4',
-                    'margin-top': '0mm',
-                    'margin-right': '0mm',
-                    'margin-bottom': '0mm',
-                    'margin-left': '0mm',
-                    'no-outline': None,
-                    'print-media-type': None,
-                    'dpi': 300
-                })
-                
-                with open(f.name, "rb") as file:
-                    st.download_button(
-                        label="📥 Télécharger le PDF",
-                        data=file,
-                        file_name=f"rapport_visite_chantier_{current_date}.pdf",
-                        mime="application/pdf"
-                    )
-                    
-            st.success("✅ PDF généré avec succès !")
-            
-        except Exception as e:
-            st.error(f"❌ Erreur lors de la génération du PDF : {str(e)}")
\ No newline at end of file
+# Rapport consolidé : toutes les visites d'un client sur une période, en un seul PDF
+def generate_consolidated_pdf(job, visites, nom_client, date_debut, date_fin):
+    def render_file(html_path):
+        job.stage = 'render'
+        return render_pool.render_file(html_path)
+
+    job.stage = 'html'
+    try:
+        pdf_bytes = render_consolidated(visit_store, visites, render_file, nom_client, date_debut, date_fin,
+                                        LOGO_BR_BASE64)
+    except Exception:
+        PDF_RENDER_FAILURES.inc()
+        raise
+    PDF_RENDERS.inc()
+    pdf_cache.put(job.id, pdf_bytes)
+    return pdf_bytes
+
+with st.expander("📚 Rapport consolidé de plusieurs visites"):
+    col_client, col_debut, col_fin = st.columns([2, 1, 1])
+    with col_client:
+        client_consolide = st.text_input("Client", key='consolidated_client')
+    with col_debut:
+        date_debut = st.date_input("Du", value=None, key='consolidated_from')
+    with col_fin:
+        date_fin = st.date_input("Au", value=None, key='consolidated_to')
+    visites_consolidees = visit_store.find(client_consolide, date_debut, date_fin) if client_consolide.strip() else []
+    if client_consolide.strip():
+        st.caption(f"{len(visites_consolidees)} visite(s) enregistrée(s) pour ce client sur la période")
+    if st.button("📚 Générer le rapport consolidé", disabled=not visites_consolidees):
+        # Same visits, saved versions, template and engine: same PDF
+        cache_key = digest(json.dumps(
+            [[visite['id'], visite['saved_at']] for visite in visites_consolidees]
+            + [client_consolide.strip(), str(date_debut), str(date_fin), TEMPLATE_VERSION, LOGO_BR_DIGEST,
+               pdf_engine.name]
+        ))
+        meta = {'file_name': f"rapport_consolide_{datetime.now().strftime('%d-%m-%Y')}.pdf"}
+        job = pdf_jobs.get(cache_key)
+        if job is not None and job.stage != 'failed':
+            PDF_CACHE_HITS.inc(source='job')
+        else:
+            pdf_bytes = pdf_cache.get(cache_key)
+            if pdf_bytes is not None:
+                PDF_CACHE_HITS.inc(source='pdf_cache')
+                job = pdf_jobs.add_finished(cache_key, pdf_bytes, meta)
+            elif not pdf_engine.available:
+                st.error(f"PDF generation is not available: {pdf_engine.unavailable_message}")
+                st.stop()
+            else:
+                PDF_CACHE_MISSES.inc()
+                job = pdf_jobs.submit(
+                    cache_key,
+                    lambda job: generate_consolidated_pdf(
+                        job, visites_consolidees, client_consolide.strip(), date_debut, date_fin
+                    ),
+                    meta
+                )
+        st.session_state['consolidated_job_id'] = job.id
+
+    job = pdf_jobs.get(st.session_state.get('consolidated_job_id'))
+    if job is not None:
+        if job.finished:
+            show_pdf_job(job)
+        else:
+            pdf_job_progress('consolidated_job_id')
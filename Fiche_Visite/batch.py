@@ -0,0 +1,138 @@
+"""Génération en lot des rapports PDF à partir de fiches sauvegardées.
+
+    python Fiche_Visite/batch.py archive/ -o rapports/
+    python Fiche_Visite/batch.py "archive/visite_chantier_2025*.json" -j 8
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from fiche import categories, parse_fiche
+from renderer import ENGINES, clean_scratch, get_engine
+from report_assets import get_logo_from_file
+from report_template import build_fiche_html
+
+# Per-process state, set up once by init_worker
+_engine = None
+_logo = None
+
+
+def collect_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = glob.glob(os.path.join(pattern, '*.json')) + glob.glob(os.path.join(pattern, '*.json.gz'))
+            paths.extend(sorted(found))
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+    # Keep the first occurrence of each file
+    return list(dict.fromkeys(os.path.abspath(p) for p in paths))
+
+
+def fiche_stem(path):
+    # visite.json and visite.json.gz both give "visite"
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.json'):
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def init_worker(engine_name=None):
+    global _engine, _logo
+    _engine = get_engine(engine_name)
+    _logo = get_logo_from_file()
+
+
+def render_one(path, output_dir):
+    result = {'file': path, 'ok': False, 'timings': {}}
+    timings = result['timings']
+    try:
+        start = time.perf_counter()
+        fiche = parse_fiche(Path(path).read_bytes())
+        timings['load'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        html = build_fiche_html(fiche, categories, logo_base64=_logo)
+        timings['html'] = time.perf_counter() - start
+
+        if not _engine.available:
+            raise RuntimeError(_engine.unavailable_message)
+        start = time.perf_counter()
+        pdf_bytes = _engine.render(html)
+        timings['render'] = time.perf_counter() - start
+
+        output = Path(output_dir) / f"rapport_{fiche_stem(path)}.pdf"
+        start = time.perf_counter()
+        output.write_bytes(pdf_bytes)
+        timings['write'] = time.perf_counter() - start
+
+        result.update(ok=True, output=str(output), size=len(pdf_bytes))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['total'] = sum(timings.values())
+    return result
+
+
+def run(paths, output_dir, workers, engine_name=None):
+    os.makedirs(output_dir, exist_ok=True)
+    # Scratch PDFs of an interrupted previous batch
+    clean_scratch()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(engine_name,)) as executor:
+        futures = [executor.submit(render_one, path, output_dir) for path in paths]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            name = os.path.basename(result['file'])
+            if result['ok']:
+                print(f"✅ {name} ({result['total']:.2f}s)")
+            else:
+                print(f"❌ {name} : {result['error']}", file=sys.stderr)
+    results.sort(key=lambda r: r['file'])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Génère les rapports PDF d'un ensemble de fiches JSON.")
+    parser.add_argument('inputs', nargs='+', help="dossiers ou motifs glob de fiches visite_chantier_*.json")
+    parser.add_argument('-o', '--output', default='rapports', help="dossier de sortie des PDF (défaut : rapports)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="nombre de processus (défaut : nombre de cœurs)")
+    parser.add_argument('--engine', choices=list(ENGINES), help="moteur PDF (défaut : BR_PDF_ENGINE ou wkhtmltopdf)")
+    parser.add_argument('--summary', help="fichier JSON du récapitulatif (défaut : <output>/batch_summary.json)")
+    args = parser.parse_args(argv)
+
+    paths = collect_inputs(args.inputs)
+    if not paths:
+        print("Aucune fiche trouvée.", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    results = run(paths, args.output, max(1, args.jobs), args.engine)
+    elapsed = time.perf_counter() - start
+
+    failures = [r for r in results if not r['ok']]
+    summary = {
+        'files': len(results),
+        'succeeded': len(results) - len(failures),
+        'failed': len(failures),
+        'workers': max(1, args.jobs),
+        'elapsed': elapsed,
+        'results': results,
+    }
+    summary_path = args.summary or os.path.join(args.output, 'batch_summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{summary['succeeded']}/{len(results)} rapports générés en {elapsed:.1f}s "
+          f"({summary['workers']} processus) – récapitulatif : {summary_path}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""Compare PDF engines on the same fiche: render time, memory, size and pixels.
+
+    python Fiche_Visite/benchmarks/bench_engines.py -d engines_out/
+    python Fiche_Visite/benchmarks/bench_engines.py --engines wkhtmltopdf weasyprint --size typical
+
+Each engine renders in its own subprocess so peak RSS (the Python process
+and, for wkhtmltopdf, the binary it spawns) is measured in isolation. The
+first engine's PDF is the reference: every page of the other outputs is
+rasterized with pypdfium2 and compared pixel by pixel, and a diff image is
+written next to the PDFs.
+"""
+import argparse
+import base64
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from synthetic import make_emargement_photo, make_fiche  # also puts Fiche_Visite/ on sys.path
+
+from fiche import categories
+from image_prep import prepare_image
+from renderer import ENGINES, PDF_OPTIONS, get_engine
+from report_assets import get_logo_from_file
+from report_template import build_fiche_html
+
+# Grey-level difference above which a pixel counts as changed
+PIXEL_THRESHOLD = 32
+
+
+def fiche_html(size):
+    emargement = None
+    if size == 'full':
+        photo = prepare_image(make_emargement_photo(), dpi=PDF_OPTIONS['dpi'])
+        emargement = base64.b64encode(photo).decode()
+    return build_fiche_html(make_fiche(size), categories, logo_base64=get_logo_from_file(),
+                            emargement_base64=emargement)
+
+
+def peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def worker(args):
+    engine = get_engine(args.worker)
+    if not engine.available:
+        print(json.dumps({'engine': engine.name, 'error': engine.unavailable_message}))
+        return
+    html = fiche_html(args.size)
+    baseline = peak_rss_mb(resource.RUSAGE_SELF)
+
+    # First render includes the engine start-up, reported separately
+    start = time.perf_counter()
+    pdf_bytes = engine.render(html)
+    first = time.perf_counter() - start
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        pdf_bytes = engine.render(html)
+        timings.append(time.perf_counter() - start)
+
+    Path(args.pdf).write_bytes(pdf_bytes)
+    print(json.dumps({
+        'engine': engine.name,
+        'first_ms': first * 1000,
+        'median_ms': statistics.median(timings) * 1000 if timings else first * 1000,
+        'min_ms': min(timings) * 1000 if timings else first * 1000,
+        'python_baseline_mb': baseline,
+        'python_peak_mb': peak_rss_mb(resource.RUSAGE_SELF),
+        'subprocess_peak_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'pdf_bytes': len(pdf_bytes),
+        'html_bytes': len(html),
+    }))
+
+
+def run_engine(name, args, pdf_path):
+    command = [sys.executable, __file__, '--worker', name, '--size', args.size,
+               '--repeat', str(args.repeat), '--pdf', str(pdf_path)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines()
+        return {'engine': name, 'error': lines[-1] if lines else 'échec du rendu'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def rasterize(pdf_path, dpi):
+    import pypdfium2
+
+    document = pypdfium2.PdfDocument(str(pdf_path))
+    try:
+        return [page.render(scale=dpi / 72).to_pil().convert('L') for page in document]
+    finally:
+        document.close()
+
+
+def visual_diff(reference_path, other_path, output_dir, name, dpi):
+    from PIL import Image, ImageChops
+
+    reference = rasterize(reference_path, dpi)
+    other = rasterize(other_path, dpi)
+    pages = []
+    for index, (ref_page, other_page) in enumerate(zip(reference, other), start=1):
+        if other_page.size != ref_page.size:
+            other_page = other_page.resize(ref_page.size)
+        diff = ImageChops.difference(ref_page, other_page)
+        changed = diff.point(lambda value: 255 if value > PIXEL_THRESHOLD else 0)
+        ratio = changed.histogram()[255] / (changed.width * changed.height)
+        # Reference | other | changed pixels, side by side
+        sheet = Image.new('L', (ref_page.width * 3, ref_page.height), 255)
+        for column, image in enumerate((ref_page, other_page, changed)):
+            sheet.paste(image, (column * ref_page.width, 0))
+        sheet.save(output_dir / f"diff_{name}_p{index}.png")
+        pages.append(round(ratio, 4))
+    return {
+        'pages_reference': len(reference),
+        'pages': len(other),
+        'changed_ratio_per_page': pages,
+        'changed_ratio_max': max(pages) if pages else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--size', choices=['empty', 'typical', 'full'], default='full')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-d', '--directory', default='engines_out', help="dossier des PDF, diffs et résultats")
+    parser.add_argument('--diff-dpi', type=int, default=50)
+    parser.add_argument('--worker', choices=list(ENGINES), help=argparse.SUPPRESS)
+    parser.add_argument('--pdf', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    output_dir = Path(args.directory)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for name in args.engines:
+        pdf_path = output_dir / f"{name}.pdf"
+        result = run_engine(name, args, pdf_path)
+        result['pdf'] = str(pdf_path)
+        results.append(result)
+
+    rendered = [r for r in results if 'error' not in r]
+    if len(rendered) > 1:
+        try:
+            reference = rendered[0]
+            for result in rendered[1:]:
+                result['diff_vs_' + reference['engine']] = visual_diff(
+                    reference['pdf'], result['pdf'], output_dir, result['engine'], args.diff_dpi
+                )
+        except ImportError:
+            print("pypdfium2 non installé : comparaison visuelle ignorée", file=sys.stderr)
+
+    print(f"{'engine':12} {'first':>9} {'median':>9} {'peak RSS':>9} {'PDF':>9}  diff")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['engine']:12} indisponible : {r['error']}")
+            continue
+        peak = max(r['python_peak_mb'], r['subprocess_peak_mb'])
+        diff = next((v for k, v in r.items() if k.startswith('diff_vs_')), None)
+        diff_text = f"max {diff['changed_ratio_max']:.1%} des pixels, {diff['pages']}/{diff['pages_reference']} pages" if diff and diff['pages'] else ''
+        print(f"{r['engine']:12} {r['first_ms']:7.0f}ms {r['median_ms']:7.0f}ms {peak:7.0f}MB "
+              f"{r['pdf_bytes'] / 1024:7.0f}KB  {diff_text}")
+
+    summary_path = output_dir / 'engines.json'
+    summary_path.write_text(json.dumps({'size': args.size, 'results': results}, ensure_ascii=False, indent=2),
+                            encoding='utf-8')
+    print(f"\nRésultats : {summary_path}")
+
+
+if __name__ == '__main__':
+    main()
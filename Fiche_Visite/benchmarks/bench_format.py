@@ -0,0 +1,57 @@
+"""Size and parse time of saved fiches: original format vs compact vs compact + gzip.
+
+    python Fiche_Visite/benchmarks/bench_format.py [--fiches 2000]
+"""
+import argparse
+import random
+import time
+
+from synthetic import make_fiche  # also puts Fiche_Visite/ on sys.path
+
+from fiche import encode_fiche, parse_fiche
+
+FORMATS = {
+    'original': {'compact': False, 'compress': False},
+    'compact': {'compact': True, 'compress': False},
+    'compact+gzip': {'compact': True, 'compress': True},
+}
+
+
+def archive(count, seed=0):
+    # Mostly typical visits, some barely started and some fully written up
+    rng = random.Random(seed)
+    sizes = rng.choices(['empty', 'typical', 'full'], [2, 7, 1], k=count)
+    return [make_fiche(size, seed=i, obs_length=400) for i, size in enumerate(sizes)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fiches', type=int, default=2000)
+    args = parser.parse_args()
+
+    fiches = archive(args.fiches)
+    reference = [parse_fiche(encode_fiche(fiche, compact=False)) for fiche in fiches]
+
+    print(f"{'format':14} {'total':>9} {'per fiche':>10} {'encode':>9} {'parse':>9}  identical")
+    for name, options in FORMATS.items():
+        start = time.perf_counter()
+        files = [encode_fiche(fiche, **options) for fiche in fiches]
+        encode = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parsed = [parse_fiche(data) for data in files]
+        parse = time.perf_counter() - start
+
+        total = sum(len(data) for data in files)
+        # Compact fiches come back with note_chantier/catalogue_version filled in
+        same = all(
+            {k: v for k, v in a.items() if k not in ('note_chantier', 'catalogue_version')}
+            == {k: v for k, v in b.items() if k not in ('note_chantier', 'catalogue_version')}
+            for a, b in zip(parsed, reference)
+        )
+        print(f"{name:14} {total / 1024:7.0f}KB {total / len(files):8.0f} B "
+              f"{encode * 1e6 / len(files):6.0f} µs {parse * 1e6 / len(files):6.0f} µs  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""HTML build time for a fully filled report.
+
+    python Fiche_Visite/benchmarks/bench_html.py [--repeat 200]
+"""
+import argparse
+import statistics
+import time
+
+from synthetic import make_fiche  # also puts Fiche_Visite/ on sys.path
+
+from fiche import categories
+from report_assets import get_logo_from_file
+from report_template import build_report_html
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--obs-length', type=int, default=2048)
+    args = parser.parse_args()
+
+    fiche = make_fiche('full', obs_length=args.obs_length)
+    notes_finales = {cat: 67 for cat in categories}
+    logo = get_logo_from_file()
+
+    # First call builds the cached stylesheet
+    html = build_report_html(fiche, notes_finales, 67.0, categories, logo_base64=logo)
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        build_report_html(fiche, notes_finales, 67.0, categories, logo_base64=logo)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    print(f"HTML size      : {len(html) / 1024:.1f} KB")
+    print(f"runs           : {args.repeat}")
+    print(f"median         : {statistics.median(timings) * 1000:.3f} ms")
+    print(f"p95            : {timings[int(len(timings) * 0.95) - 1] * 1000:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
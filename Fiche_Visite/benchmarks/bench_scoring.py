@@ -0,0 +1,56 @@
+"""Batched scoring of many visits against the per-fiche reference.
+
+    python Fiche_Visite/benchmarks/bench_scoring.py [--visits 100000]
+"""
+import argparse
+import random
+import time
+
+from synthetic import EVALUATIONS  # also puts Fiche_Visite/ on sys.path
+
+from catalogue import eval_key
+from fiche import categories
+from scoring import category_notes, compute_scores, evaluation_matrix, score_matrix, visit_scores
+
+
+def synthetic_visits(count, seed=0):
+    rng = random.Random(seed)
+    keys = [eval_key(cat, crit) for cat, criteres in categories.items() for crit in criteres]
+    # Skew towards "Non Applicable" like real fiches, with some all-NA categories
+    weights = [4, 1, 2, 3]
+    return [dict(zip(keys, rng.choices(EVALUATIONS, weights, k=len(keys)))) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--visits', type=int, default=100_000)
+    args = parser.parse_args()
+
+    fiches = synthetic_visits(args.visits)
+
+    start = time.perf_counter()
+    codes = evaluation_matrix(fiches, categories)
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    notes_finales, note_chantier = score_matrix(codes, categories)
+    batched = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = [compute_scores(category_notes(fiche, categories)) for fiche in fiches]
+    loop = time.perf_counter() - start
+
+    mismatches = sum(
+        visit_scores(notes_finales, note_chantier, i) != expected
+        for i, expected in enumerate(reference)
+    )
+    print(f"visits         : {args.visits}")
+    print(f"matrix load    : {load:.3f} s")
+    print(f"batched score  : {batched * 1000:.1f} ms")
+    print(f"per-fiche loop : {loop:.3f} s")
+    print(f"speed-up       : {loop / batched:.0f}x scoring, {loop / (load + batched):.1f}x with load")
+    print(f"mismatches     : {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
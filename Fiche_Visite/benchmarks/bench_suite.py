@@ -0,0 +1,186 @@
+"""Report lifecycle benchmark on empty, typical and full synthetic fiches.
+
+    python Fiche_Visite/benchmarks/bench_suite.py -o bench.json
+    python Fiche_Visite/benchmarks/bench_suite.py -o bench.json --compare previous.json
+
+Stages: a full app rerun through Streamlit's AppTest, the JSON load done by
+the uploader, scoring, émargement preparation, HTML assembly and the
+PDF render with the selected engine (skipped when it is not available).
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from synthetic import make_emargement_photo, make_fiche  # also puts Fiche_Visite/ on sys.path
+
+from fiche import categories, parse_date, parse_fiche
+from image_prep import prepare_image
+from renderer import ENGINES, PDF_OPTIONS, get_engine
+from report_assets import get_logo_from_file
+from report_template import build_report_html
+from scoring import category_notes, compute_scores
+
+APP_PATH = Path(__file__).resolve().parent.parent / 'app.py'
+SIZES = ['empty', 'typical', 'full']
+STAGES = ['rerun', 'load', 'score', 'emargement', 'html', 'render']
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'runs': repeat,
+        'median_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        'min_ms': timings[0] * 1000,
+    }
+
+
+def app_rerun(fiche, repeat):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=120)
+    for key, value in fiche.items():
+        at.session_state[key] = parse_date(value) if key == 'date' else value
+    # First run imports the app modules and fills the resource caches
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return measure(at.run, repeat)
+
+
+def bench_fiche(size, args, engine, logo, photo):
+    fiche = make_fiche(size, obs_length=args.obs_length)
+    saved = json.dumps(fiche, ensure_ascii=False, indent=2).encode('utf-8-sig')
+    # Only the full fiche comes with an émargement photo
+    emargement = photo if size == 'full' else None
+    results = {'json_bytes': len(saved)}
+
+    if not args.skip_app:
+        results['rerun'] = app_rerun(fiche, args.app_repeat)
+    results['load'] = measure(lambda: parse_fiche(saved), args.repeat)
+    results['score'] = measure(lambda: compute_scores(category_notes(fiche, categories)), args.repeat)
+
+    notes_finales, note_chantier = compute_scores(category_notes(fiche, categories))
+    emargement_base64 = None
+    if emargement is not None:
+        # Uncached path: resize, recompress and encode the upload
+        results['emargement'] = measure(
+            lambda: base64.b64encode(prepare_image(emargement, dpi=PDF_OPTIONS['dpi'])),
+            max(1, args.repeat // 20)
+        )
+        emargement_base64 = base64.b64encode(prepare_image(emargement, dpi=PDF_OPTIONS['dpi'])).decode()
+
+    def build():
+        return build_report_html(fiche, notes_finales, note_chantier, categories,
+                                 logo_base64=logo, emargement_base64=emargement_base64)
+
+    html = build()
+    results['html_bytes'] = len(html)
+    results['html'] = measure(build, args.repeat)
+
+    if engine.available and not args.skip_render:
+        results['render'] = measure(lambda: engine.render(html), args.render_repeat)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_PATH.parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous, threshold):
+    regressions = 0
+    print(f"\n{'fiche':8} {'stage':11} {'before':>10} {'after':>10} {'change':>8}")
+    for size, stages in current['results'].items():
+        for stage in STAGES:
+            before = previous.get('results', {}).get(size, {}).get(stage)
+            after = stages.get(stage)
+            if not before or not after:
+                continue
+            change = after['median_ms'] / before['median_ms'] - 1
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f"{size:8} {stage:11} {before['median_ms']:9.2f}ms {after['median_ms']:9.2f}ms {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help="fichier JSON des résultats (défaut : sortie standard)")
+    parser.add_argument('--compare', help="résultats JSON d'une exécution précédente")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="hausse de la médiane signalée comme régression (défaut : 0.10)")
+    parser.add_argument('--sizes', nargs='+', choices=SIZES, default=SIZES)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--app-repeat', type=int, default=10)
+    parser.add_argument('--render-repeat', type=int, default=5)
+    parser.add_argument('--obs-length', type=int, default=2048)
+    parser.add_argument('--skip-app', action='store_true', help="ne pas mesurer les reruns Streamlit")
+    parser.add_argument('--engine', choices=list(ENGINES), help="moteur PDF (défaut : BR_PDF_ENGINE ou wkhtmltopdf)")
+    parser.add_argument('--skip-render', action='store_true', help="ne pas lancer le rendu PDF")
+    args = parser.parse_args()
+
+    # Keep the app's visit store away from the working tree
+    os.environ['BR_VISIT_DB'] = os.path.join(tempfile.mkdtemp(prefix='bench_'), 'visites.db')
+
+    engine = get_engine(args.engine)
+    if not engine.available and not args.skip_render:
+        print(f"{engine.unavailable_message} : étape render ignorée", file=sys.stderr)
+    logo = get_logo_from_file()
+    photo = make_emargement_photo()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engine': engine.name,
+            'emargement_bytes': len(photo),
+            'obs_length': args.obs_length,
+        },
+        'results': {},
+    }
+    for size in args.sizes:
+        results = bench_fiche(size, args, engine, logo, photo)
+        report['results'][size] = results
+        for stage in STAGES:
+            if stage in results:
+                print(f"{size:8} {stage:11} median {results[stage]['median_ms']:9.3f} ms"
+                      f"   p95 {results[stage]['p95_ms']:9.3f} ms", file=sys.stderr)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding='utf-8')
+    else:
+        print(output)
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        if compare(report, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from catalogue import eval_key, obs_key  # noqa: E402
+from fiche import categories  # noqa: E402
+
+EVALUATIONS = ["Non Applicable", "Non Satisfaisant", "Partiellement Satisfaisant", "Satisfaisant"]
+TRAVAUX = ["Ravalement", "Gros œuvre", "Maçonnerie", "Échafaudage", "ITE", "Peinture", "Étanchéité"]
+WORDS = (
+    "échafaudage garde-corps harnais balisage poussière déchets benne riverains "
+    "extincteur consignation EPI casque gants chantier protection trémie"
+).split()
+
+
+def text(length, rng):
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def make_fiche(size='typical', seed=0, obs_length=2048):
+    """Synthetic saved fiche: 'empty', 'typical' or 'full' (every criterion
+    evaluated with obs_length-character observations)."""
+    rng = random.Random(seed)
+    fiche = {
+        'date': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'heure': "09:30",
+        'nom_client': f"Client {rng.randint(1, 50)}",
+        'adresse': f"{rng.randint(1, 200)} rue de la République, Lyon",
+        'presence_sst': rng.choice(["Oui", "Non"]),
+        'effectif': rng.randint(0, 40),
+        'conducteur': "Jean Martin",
+        'chef_chantier': "Paul Durand",
+        'contact_chantier': "06 12 34 56 78",
+        'redacteur_rapport': "Claire Bernard",
+        'travaux_selectionnes': [],
+        'travaux_autres': '',
+        'theme_visite': '',
+        'evaluation_generale': '',
+        'lien_photos': '',
+    }
+    if size != 'empty':
+        fiche['travaux_selectionnes'] = rng.sample(TRAVAUX, 3)
+        fiche['theme_visite'] = "Travail en hauteur"
+        fiche['evaluation_generale'] = text(obs_length if size == 'full' else 300, rng)
+        fiche['lien_photos'] = "https://www.dropbox.com/sh/exemple/photos"
+    for cat, criteres in categories.items():
+        for crit in criteres:
+            if size == 'empty':
+                note, obs = "Non Applicable", ""
+            elif size == 'full':
+                note, obs = rng.choice(EVALUATIONS[1:]), text(obs_length, rng)
+            else:
+                note = rng.choice(EVALUATIONS)
+                obs = text(80, rng) if rng.random() < 0.3 else ""
+            fiche[eval_key(cat, crit)] = note
+            fiche[obs_key(cat, crit)] = obs
+    return fiche
+
+
+def make_emargement_photo(width=4032, height=3024, seed=0, quality=92):
+    """JPEG as it comes out of a phone camera; noise keeps it from compressing
+    to an unrealistically small file."""
+    from io import BytesIO
+
+    from PIL import Image
+
+    rng = random.Random(seed)
+    noise = Image.effect_noise((width, height), 48).convert('RGB')
+    paper = Image.new('RGB', (width, height), (rng.randint(220, 245),) * 3)
+    img = Image.blend(paper, noise, 0.35)
+    out = BytesIO()
+    img.save(out, 'JPEG', quality=quality)
+    return out.getvalue()
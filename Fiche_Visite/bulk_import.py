@@ -0,0 +1,106 @@
+import json
+import os
+import zipfile
+import zlib
+
+from fiche import MAX_FICHE_BYTES, FicheError, parse_fiche
+
+MAX_ENTRIES = 5000
+FICHE_SUFFIXES = ('.json', '.json.gz')
+
+
+def iter_fiche_files(uploads):
+    """(name, bytes or error) for every JSON fiche of the uploaded files.
+
+    ZIP archives are read entry by entry from the upload itself, nothing is
+    extracted to disk, and each entry is read up to MAX_FICHE_BYTES only.
+    """
+    count = 0
+    for upload in uploads:
+        name = upload.name
+        if name.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(upload)
+            except zipfile.BadZipFile:
+                yield name, FicheError("archive ZIP illisible")
+                continue
+            with archive:
+                for info in archive.infolist():
+                    entry = info.filename
+                    # Skip folders and macOS resource forks
+                    if info.is_dir() or entry.startswith('__MACOSX/') or os.path.basename(entry).startswith('._'):
+                        continue
+                    label = f"{name}/{entry}"
+                    if not entry.lower().endswith(FICHE_SUFFIXES):
+                        yield label, FicheError("fichier ignoré : ce n'est pas une fiche .json ou .json.gz")
+                        continue
+                    count += 1
+                    if count > MAX_ENTRIES:
+                        yield label, FicheError(f"import limité à {MAX_ENTRIES} fiches")
+                        return
+                    if info.file_size > MAX_FICHE_BYTES:
+                        yield label, FicheError("fichier trop volumineux pour une fiche")
+                        continue
+                    try:
+                        with archive.open(info) as f:
+                            data = f.read(MAX_FICHE_BYTES + 1)
+                    except (zipfile.BadZipFile, zlib.error, EOFError, OSError, RuntimeError, NotImplementedError) as e:
+                        # Corrupted or truncated data, encrypted or unsupported compression
+                        yield label, FicheError(f"entrée illisible ({e})")
+                        continue
+                    if len(data) > MAX_FICHE_BYTES:
+                        yield label, FicheError("fichier trop volumineux pour une fiche")
+                        continue
+                    yield label, data
+        else:
+            count += 1
+            if count > MAX_ENTRIES:
+                yield name, FicheError(f"import limité à {MAX_ENTRIES} fiches")
+                return
+            yield name, upload.getvalue()
+
+
+def import_fiches(uploads, store, batch_size=200):
+    """Validate every fiche like the single-file loader and store the valid ones.
+
+    Returns the per-file report: [{'file', 'ok', 'visit_id' or 'error'}];
+    fiches already imported are reported with 'duplicate'.
+    """
+    report = []
+    pending = []
+
+    def flush():
+        ids = store.save_many([fiche for _, fiche in pending])
+        for (entry, _), visit_id in zip(pending, ids):
+            if visit_id is None:
+                entry.update(ok=False, duplicate=True, error="fiche déjà importée")
+            else:
+                entry['visit_id'] = visit_id
+        pending.clear()
+
+    for name, data in iter_fiche_files(uploads):
+        entry = {'file': name, 'ok': False}
+        report.append(entry)
+        if isinstance(data, Exception):
+            entry['error'] = str(data)
+            continue
+        try:
+            fiche = parse_fiche(data)
+        except json.JSONDecodeError:
+            entry['error'] = "JSON invalide"
+            continue
+        except UnicodeDecodeError:
+            entry['error'] = "encodage invalide (UTF-8 attendu)"
+            continue
+        except FicheError as e:
+            entry['error'] = str(e)
+            continue
+        entry['ok'] = True
+        entry['date'] = fiche['date']
+        entry['adresse'] = fiche['adresse']
+        pending.append((entry, fiche))
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    return report
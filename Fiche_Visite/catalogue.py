@@ -0,0 +1,100 @@
+import json
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+CATALOGUE_PATH = Path(__file__).parent / 'catalogue.json'
+
+# Fiches saved before the catalogue was versioned
+UNVERSIONED = 1
+
+Criterion = namedtuple('Criterion', 'category label eval_key obs_key id')
+
+
+class CatalogueError(ValueError):
+    pass
+
+
+def eval_key(category, label):
+    return f"{category}_{label}"
+
+
+def obs_key(category, label):
+    return f"obs_{category}_{label}"
+
+
+class Catalogue:
+    """Criteria grid compiled from catalogue.json.
+
+    Every state / fiche key is computed once here. renames maps the keys of
+    earlier labels (previous_names of a category, previous_labels of a
+    criterion) to the current ones, so a fiche of any older version is
+    upgraded in a single pass over its keys. Each criterion also has a short
+    id that never changes or gets reused, used by the compact fiche format.
+    """
+
+    def __init__(self, data):
+        try:
+            self.version = int(data['version'])
+            sections = data['categories']
+        except (KeyError, TypeError, ValueError):
+            raise CatalogueError("Catalogue des critères invalide : version et categories attendues")
+
+        self.categories = {}
+        self.by_category = {}
+        self.by_id = {}
+        self.renames = {}
+        criteria = []
+        for section in sections:
+            category = section['name']
+            labels = [criterion['label'] for criterion in section['criteria']]
+            if category in self.categories or len(set(labels)) != len(labels):
+                raise CatalogueError(f"Critères en double dans la catégorie {category}")
+            self.categories[category] = labels
+            entries = [Criterion(category, criterion['label'], eval_key(category, criterion['label']),
+                                 obs_key(category, criterion['label']), criterion.get('id'))
+                       for criterion in section['criteria']]
+            for entry in entries:
+                if not entry.id or entry.id in self.by_id:
+                    raise CatalogueError(f"Identifiant manquant ou en double pour le critère {entry.label}")
+                self.by_id[entry.id] = entry
+            self.by_category[category] = entries
+            criteria.extend(entries)
+
+            old_categories = [category] + list(section.get('previous_names', []))
+            for criterion, entry in zip(section['criteria'], entries):
+                for old_category in old_categories:
+                    for old_label in [entry.label] + list(criterion.get('previous_labels', [])):
+                        if (old_category, old_label) != (category, entry.label):
+                            self.renames[eval_key(old_category, old_label)] = entry.eval_key
+                            self.renames[obs_key(old_category, old_label)] = entry.obs_key
+
+        self.criteria = tuple(criteria)
+        self.eval_keys = tuple(entry.eval_key for entry in criteria)
+        self.obs_keys = tuple(entry.obs_key for entry in criteria)
+        current = set(self.eval_keys) | set(self.obs_keys)
+        clashes = current.intersection(self.renames)
+        if clashes:
+            raise CatalogueError(f"Ancien libellé réutilisé par un critère actuel : {sorted(clashes)[0]}")
+
+    def migrate(self, fiche):
+        """Upgrade a fiche dict in place to this catalogue; returns True if it changed."""
+        version = fiche.get('catalogue_version', UNVERSIONED)
+        if version == self.version:
+            return False
+        if not isinstance(version, int) or version > self.version:
+            raise CatalogueError(
+                f"Fiche enregistrée avec le catalogue {version}, plus récent que celui de l'application ({self.version})"
+            )
+        for old in [key for key in fiche if key in self.renames]:
+            value = fiche.pop(old)
+            # A value already under the current key wins over the old label
+            fiche.setdefault(self.renames[old], value)
+        fiche['catalogue_version'] = self.version
+        return True
+
+
+@lru_cache(maxsize=4)
+def load_catalogue(path=CATALOGUE_PATH):
+    with open(path, encoding='utf-8') as f:
+        return Catalogue(json.load(f))
@@ -0,0 +1,116 @@
+"""Rapport PDF consolidé des visites d'un client sur une période.
+
+    python Fiche_Visite/consolidated.py --store Fiche_Visite/visites.db --client "ACME" -o acme_2025.pdf
+    python Fiche_Visite/consolidated.py --store visites.db --client "ACME" --from 2025-01-01 --to 2025-06-30 --html
+"""
+import argparse
+import sys
+import time
+from datetime import date
+
+from fiche import categories
+from metrics import span
+from renderer import ENGINES, assert_offline, get_engine, scratch_file
+from report_assets import get_logo_from_file
+from report_template import format_date, write_consolidated_html
+from scoring import score_fiches, visit_scores
+from visit_store import VisitStore
+
+# Visits parsed and scored together; bounds memory whatever the period
+SCORE_BATCH = 200
+
+
+def score_visits(store, visits, batch_size=SCORE_BATCH):
+    """Cover rows (date, adresse, notes, note) of the visit summaries, in order."""
+    rows = []
+    for start in range(0, len(visits), batch_size):
+        batch = visits[start:start + batch_size]
+        fiches = list(store.iter_payloads([visit['id'] for visit in batch]))
+        notes_finales, note_chantier = score_fiches(fiches, categories)
+        for index, visit in enumerate(batch):
+            notes, note = visit_scores(notes_finales, note_chantier, index)
+            rows.append({'id': visit['id'], 'date': visit['date'], 'adresse': visit['adresse'],
+                         'notes': notes, 'note': note})
+    return rows
+
+
+def summary_info(rows, nom_client, date_from=None, date_to=None):
+    notes = [row['note'] for row in rows if isinstance(row['note'], (int, float))]
+    period = f"{format_date(date_from or rows[0]['date'])} au {format_date(date_to or rows[-1]['date'])}"
+    return [
+        ("Client", nom_client or "Tous les clients"),
+        ("Période", period),
+        ("Visites", len(rows)),
+        ("Chantiers", len({row['adresse'] for row in rows})),
+        ("Note moyenne", f"{sum(notes) / len(notes):.1f}%" if notes else "N/A"),
+        ("Dernière note", f"{notes[-1]}%" if notes else "N/A"),
+    ]
+
+
+def write_html(out, store, visits, nom_client=None, date_from=None, date_to=None, logo_base64=None):
+    """Score the visits, then stream the whole report to out; returns the cover rows."""
+    with span('score', visits=len(visits)):
+        rows = score_visits(store, visits)
+    info = summary_info(rows, nom_client, date_from, date_to)
+    with span('html', visits=len(visits)):
+        write_consolidated_html(
+            out, info, rows, store.iter_payloads([row['id'] for row in rows]), categories,
+            logo_base64=logo_base64, check=assert_offline
+        )
+    return rows
+
+
+def render_consolidated(store, visits, render_file, nom_client=None, date_from=None, date_to=None,
+                        logo_base64=None):
+    """One PDF for all the visits, from a single engine run over a scratch HTML file.
+
+    render_file(path) is the engine's (or the render pool's) render_file.
+    """
+    if not visits:
+        raise ValueError("Aucune visite à consolider")
+    with scratch_file('.html') as html_path:
+        with open(html_path, 'w', encoding='utf-8') as out:
+            write_html(out, store, visits, nom_client, date_from, date_to, logo_base64)
+        with span('render', visits=len(visits)):
+            return render_file(html_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Génère un rapport PDF unique pour plusieurs visites.")
+    parser.add_argument('--store', required=True, help="base SQLite des visites")
+    parser.add_argument('--client', help="nom du client (tous les clients si absent)")
+    parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help="première date (AAAA-MM-JJ)")
+    parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help="dernière date (AAAA-MM-JJ)")
+    parser.add_argument('-o', '--output', default='rapport_consolide.pdf', help="fichier de sortie")
+    parser.add_argument('--engine', choices=list(ENGINES), help="moteur PDF (défaut : BR_PDF_ENGINE ou wkhtmltopdf)")
+    parser.add_argument('--html', action='store_true', help="écrire le HTML au lieu du PDF")
+    args = parser.parse_args(argv)
+
+    store = VisitStore(args.store)
+    try:
+        visits = store.find(args.client, args.date_from, args.date_to)
+        if not visits:
+            print("Aucune visite trouvée.", file=sys.stderr)
+            return 1
+        logo = get_logo_from_file()
+        start = time.perf_counter()
+        if args.html:
+            with open(args.output, 'w', encoding='utf-8') as out:
+                write_html(out, store, visits, args.client, args.date_from, args.date_to, logo)
+        else:
+            engine = get_engine(args.engine)
+            if not engine.available:
+                print(engine.unavailable_message, file=sys.stderr)
+                return 1
+            pdf_bytes = render_consolidated(store, visits, engine.render_file, args.client,
+                                            args.date_from, args.date_to, logo)
+            with open(args.output, 'wb') as out:
+                out.write(pdf_bytes)
+    finally:
+        store.close()
+    print(f"{len(visits)} visites → {args.output} en {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+# A draft is written DEBOUNCE_SECONDS after its last change, and at the latest
+# MAX_DELAY_SECONDS after its first unsaved change, however busy the form is
+DEBOUNCE_SECONDS = 3
+MAX_DELAY_SECONDS = 15
+MAX_AGE_DAYS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    id TEXT PRIMARY KEY,
+    label TEXT NOT NULL DEFAULT '',
+    visit_id INTEGER,
+    catalogue_version INTEGER,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS drafts_updated ON drafts (updated_at);
+CREATE TABLE IF NOT EXISTS draft_fields (
+    draft_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (draft_id, field)
+) WITHOUT ROWID;
+"""
+
+
+class DraftStore:
+    """Drafts of fiches being filled in, one row per form field.
+
+    Only the fields that changed are rewritten, so saving a draft costs the
+    same whether one observation or the whole form was edited.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def write_many(self, drafts):
+        """drafts: {draft_id: {'fields': {...}, 'label', 'visit_id', 'catalogue_version'}}"""
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            for draft_id, draft in drafts.items():
+                self._conn.execute(
+                    "INSERT INTO drafts (id, label, visit_id, catalogue_version, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET label = excluded.label, visit_id = excluded.visit_id, "
+                    "catalogue_version = excluded.catalogue_version, updated_at = excluded.updated_at",
+                    (draft_id, draft.get('label', ''), draft.get('visit_id'), draft.get('catalogue_version'), now)
+                )
+                self._conn.executemany(
+                    "INSERT INTO draft_fields (draft_id, field, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT DO UPDATE SET value = excluded.value",
+                    [(draft_id, field, json.dumps(value, ensure_ascii=False, default=str))
+                     for field, value in draft['fields'].items()]
+                )
+
+    def get(self, draft_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM drafts WHERE id = ?", (draft_id,)).fetchone()
+        return dict(row) if row else None
+
+    def load(self, draft_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT field, value FROM draft_fields WHERE draft_id = ?", (draft_id,)
+            ).fetchall()
+        return {row['field']: json.loads(row['value']) for row in rows}
+
+    def delete(self, draft_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM draft_fields WHERE draft_id = ?", (draft_id,))
+            self._conn.execute("DELETE FROM drafts WHERE id = ?", (draft_id,))
+
+    def prune(self, max_age_days=MAX_AGE_DAYS):
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM draft_fields WHERE draft_id IN (SELECT id FROM drafts WHERE updated_at < ?)", (cutoff,)
+            )
+            return self._conn.execute("DELETE FROM drafts WHERE updated_at < ?", (cutoff,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DraftWriter:
+    """Debounces draft changes from every session and writes them from one thread.
+
+    update() only records the changed fields in memory; consecutive changes
+    to a draft are merged and written together once the form is idle.
+    """
+
+    def __init__(self, store, delay=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS):
+        self.store = store
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending = {}
+        self._cond = threading.Condition()
+        # Held while writing, so a discarded draft is not written back afterwards
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="draft-writer", daemon=True)
+        self._thread.start()
+
+    def update(self, draft_id, fields, **meta):
+        now = time.monotonic()
+        with self._cond:
+            pending = self._pending.get(draft_id)
+            if pending is None:
+                pending = self._pending[draft_id] = {'fields': {}, 'first': now}
+            pending['fields'].update(fields)
+            pending.update(meta, last=now)
+            self._cond.notify()
+
+    def flush(self, draft_id=None):
+        # Write now, e.g. before reading a draft back
+        with self._write_lock:
+            with self._cond:
+                ids = [draft_id] if draft_id is not None else list(self._pending)
+                due = {i: self._pending.pop(i) for i in ids if i in self._pending}
+            if due:
+                self.store.write_many(due)
+
+    def discard(self, draft_id):
+        with self._write_lock:
+            with self._cond:
+                self._pending.pop(draft_id, None)
+            self.store.delete(draft_id)
+
+    def _due_at(self, pending):
+        return min(pending['last'] + self.delay, pending['first'] + self.max_delay)
+
+    def _take_due(self):
+        now = time.monotonic()
+        return {i: self._pending.pop(i) for i in list(self._pending) if self._due_at(self._pending[i]) <= now}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                wait = min(self._due_at(p) for p in self._pending.values()) - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            with self._write_lock:
+                with self._cond:
+                    due = self._take_due()
+                try:
+                    if due:
+                        self.store.write_many(due)
+                except sqlite3.Error as e:
+                    print(f"Draft autosave failed: {e}")
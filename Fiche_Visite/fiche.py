@@ -0,0 +1,162 @@
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime
+
+from catalogue import CatalogueError, load_catalogue
+
+# Catalogue des critères, compilé une fois au démarrage depuis catalogue.json
+CATALOGUE = load_catalogue()
+categories = CATALOGUE.categories
+
+# Champs requis pour charger une fiche (nom_client exclu pour compatibilité)
+REQUIRED_FIELDS = ['date', 'adresse', 'conducteur', 'chef_chantier', 'contact_chantier']
+
+BASIC_FIELDS = [
+    'nom_client', 'heure', 'adresse', 'presence_sst', 'effectif', 'conducteur',
+    'chef_chantier', 'contact_chantier', 'redacteur_rapport', 'travaux_selectionnes',
+    'travaux_autres', 'theme_visite', 'evaluation_generale', 'lien_photos'
+]
+
+# Valeurs d'un formulaire vierge, omises du format compact
+FIELD_DEFAULTS = {
+    'nom_client': '', 'heure': '', 'adresse': '', 'presence_sst': 'Non', 'effectif': 0,
+    'conducteur': '', 'chef_chantier': '', 'contact_chantier': '', 'redacteur_rapport': '',
+    'travaux_selectionnes': [], 'travaux_autres': '', 'theme_visite': '',
+    'evaluation_generale': '', 'lien_photos': ''
+}
+DEFAULT_EVALUATION = "Non Applicable"
+
+# Compact format: only non-default values, criteria under their catalogue id
+COMPACT_FORMAT = 2
+EVALUATION_SHORT = {"Non Satisfaisant": "NS", "Partiellement Satisfaisant": "PS", "Satisfaisant": "S"}
+EVALUATION_LONG = {short: note for note, short in EVALUATION_SHORT.items()}
+
+# Blank fiche the compact format is expanded onto
+BLANK_FICHE = dict(FIELD_DEFAULTS)
+BLANK_FICHE.update((critere.eval_key, DEFAULT_EVALUATION) for critere in CATALOGUE.criteria)
+BLANK_FICHE.update((critere.obs_key, "") for critere in CATALOGUE.criteria)
+
+GZIP_MAGIC = b'\x1f\x8b'
+# A saved fiche is a few tens of KB; anything far larger is not one
+MAX_FICHE_BYTES = 5 * 1024 * 1024
+
+
+class FicheError(ValueError):
+    pass
+
+
+def parse_date(date_str):
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise FicheError("Format de date invalide dans le fichier")
+
+
+def compact_fiche(fiche):
+    """Compact (format 2) form of a fiche of the current catalogue."""
+    compact = {'format': COMPACT_FORMAT, 'catalogue_version': CATALOGUE.version, 'date': str(fiche['date'])}
+    for field, default in FIELD_DEFAULTS.items():
+        value = fiche.get(field, default)
+        if value != default:
+            compact[field] = value
+    if fiche.get('note_chantier') not in (None, "NA"):
+        compact['note_chantier'] = fiche['note_chantier']
+    evaluations = {}
+    observations = {}
+    for critere in CATALOGUE.criteria:
+        note = fiche.get(critere.eval_key, DEFAULT_EVALUATION)
+        if note != DEFAULT_EVALUATION:
+            evaluations[critere.id] = EVALUATION_SHORT.get(note, note)
+        if fiche.get(critere.obs_key):
+            observations[critere.id] = fiche[critere.obs_key]
+    if evaluations:
+        compact['evaluations'] = evaluations
+    if observations:
+        compact['observations'] = observations
+    return compact
+
+
+def expand_fiche(compact):
+    # Back to the full form every other part of the app works with
+    version = compact.get('catalogue_version', CATALOGUE.version)
+    if not isinstance(version, int) or version > CATALOGUE.version:
+        raise FicheError(
+            f"Fiche enregistrée avec le catalogue {version}, plus récent que celui de l'application ({CATALOGUE.version})"
+        )
+    evaluations = compact.get('evaluations', {})
+    observations = compact.get('observations', {})
+    if not isinstance(evaluations, dict) or not isinstance(observations, dict):
+        raise FicheError("Évaluations illisibles dans le fichier")
+
+    fiche = dict(BLANK_FICHE, travaux_selectionnes=[])
+    fiche.update((key, value) for key, value in compact.items() if key in FIELD_DEFAULTS)
+    fiche['date'] = compact.get('date')
+    fiche['note_chantier'] = compact.get('note_chantier', "NA")
+    # Ids are stable across label renames: no migration needed
+    for critere_id, note in evaluations.items():
+        critere = CATALOGUE.by_id.get(critere_id)
+        if critere is not None:
+            fiche[critere.eval_key] = EVALUATION_LONG.get(note, note)
+    for critere_id, obs in observations.items():
+        critere = CATALOGUE.by_id.get(critere_id)
+        if critere is not None:
+            fiche[critere.obs_key] = obs
+    fiche['catalogue_version'] = CATALOGUE.version
+    return fiche
+
+
+def encode_fiche(fiche, compact=True, compress=False):
+    """Bytes of a saved fiche: compact JSON (or the original indented format), optionally gzipped."""
+    if compact:
+        data = json.dumps(compact_fiche(fiche), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    else:
+        data = json.dumps(fiche, ensure_ascii=False, indent=2).encode('utf-8-sig')
+    # mtime=0: the same fiche always gives the same file
+    return gzip.compress(data, mtime=0) if compress else data
+
+
+def gunzip_fiche(content):
+    try:
+        with gzip.GzipFile(fileobj=io.BytesIO(content)) as f:
+            data = f.read(MAX_FICHE_BYTES + 1)
+    except (OSError, EOFError, zlib.error):
+        raise FicheError("Fichier gzip illisible")
+    if len(data) > MAX_FICHE_BYTES:
+        raise FicheError("Fichier trop volumineux pour une fiche")
+    return data
+
+
+def parse_fiche(content):
+    # Original fiches are UTF-8 with a BOM, compact ones may be gzipped
+    if isinstance(content, bytes):
+        if content[:2] == GZIP_MAGIC:
+            content = gunzip_fiche(content)
+        content = content.decode('utf-8-sig')
+    saved_data = json.loads(content)
+    if not isinstance(saved_data, dict):
+        raise FicheError("Le fichier ne contient pas une fiche de visite")
+
+    fiche_format = saved_data.get('format')
+    if fiche_format == COMPACT_FORMAT:
+        saved_data = expand_fiche(saved_data)
+    elif fiche_format is not None:
+        raise FicheError(f"Format de fiche {fiche_format} non pris en charge")
+
+    missing_fields = [field for field in REQUIRED_FIELDS if field not in saved_data]
+    if missing_fields:
+        raise FicheError(f"Champs requis manquants dans le fichier : {', '.join(missing_fields)}")
+
+    # Handle nom_client field for backward compatibility
+    if 'nom_client' not in saved_data:
+        saved_data['nom_client'] = ''
+
+    parse_date(saved_data['date'])
+
+    # Criteria renamed since the fiche was saved move to their current keys
+    try:
+        CATALOGUE.migrate(saved_data)
+    except CatalogueError as e:
+        raise FicheError(str(e))
+    return saved_data
@@ -0,0 +1,177 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# CSS box the émargement is displayed in: usable width of the A4 page-wrapper
+# (210mm minus margins and paddings, ~680px at 96 px/in) by max-height: 400px
+EMARGEMENT_MAX_CSS_WIDTH = 680
+EMARGEMENT_MAX_CSS_HEIGHT = 400
+CSS_DPI = 96
+JPEG_QUALITY = 85
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def target_size(width, height, dpi, max_css_width=EMARGEMENT_MAX_CSS_WIDTH, max_css_height=EMARGEMENT_MAX_CSS_HEIGHT):
+    # Pixels actually needed to fill the CSS box at the PDF resolution
+    scale = dpi / CSS_DPI
+    ratio = min(1.0, max_css_width * scale / width, max_css_height * scale / height)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def prepare_image(data, dpi=300, max_css_width=EMARGEMENT_MAX_CSS_WIDTH,
+                  max_css_height=EMARGEMENT_MAX_CSS_HEIGHT, quality=JPEG_QUALITY):
+    with Image.open(BytesIO(data)) as img:
+        orientation = img.getexif().get(0x0112, 1)
+        width, height = img.size
+        if orientation in _TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        size = target_size(width, height, dpi, max_css_width, max_css_height)
+
+        # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+        if img.format == 'JPEG':
+            draft_size = (size[1], size[0]) if orientation in _TRANSPOSED_ORIENTATIONS else size
+            img.draft('RGB', draft_size)
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, 'white')
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS)
+
+        out = BytesIO()
+        img.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+# Prepared images keyed by content hash, shared by every session and usable
+# from background render threads
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+PREPARED_CACHE_ENTRIES = 32
+
+
+def prepared_base64(content_digest, data, dpi=300):
+    key = (content_digest, dpi)
+    with _prepared_lock:
+        if key in _prepared:
+            _prepared.move_to_end(key)
+            return _prepared[key]
+    try:
+        prepared = prepare_image(data, dpi=dpi)
+    except Exception as e:
+        print(f"Error preparing image: {e}")
+        prepared = data
+    encoded = base64.b64encode(prepared).decode()
+    with _prepared_lock:
+        _prepared[key] = encoded
+        while len(_prepared) > PREPARED_CACHE_ENTRIES:
+            _prepared.popitem(last=False)
+    return encoded
+
+
+# Contact sheet cell (3 photos across the page, 4 rows): smaller and at a lower
+# resolution than the émargement, so 50 photos stay a few MB of PDF
+THUMBNAIL_CSS_WIDTH = 200
+THUMBNAIL_CSS_HEIGHT = 150
+THUMBNAIL_DPI = 200
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+# Unreadable photos remembered, so they are not decoded again on every poll
+THUMBNAIL_FAILURES = 256
+
+
+def make_thumbnail(data, dpi=THUMBNAIL_DPI):
+    return prepare_image(data, dpi=dpi, max_css_width=THUMBNAIL_CSS_WIDTH,
+                         max_css_height=THUMBNAIL_CSS_HEIGHT, quality=THUMBNAIL_QUALITY)
+
+
+class ThumbnailPool:
+    """Photo thumbnails generated on worker threads and shared by every session.
+
+    Results are cached by content hash, bounded in bytes (least recently used
+    first out), and so are photos that cannot be decoded. Photos are only read
+    by the worker, so at most `workers` full-size images are decoded at once
+    whatever the number submitted.
+    """
+
+    def __init__(self, workers=None, max_bytes=THUMBNAIL_CACHE_BYTES):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+        self._cache = OrderedDict()
+        self._size = 0
+        self._futures = {}
+        self._failed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            thumbnail = self._cache.get(key)
+            if thumbnail is not None:
+                self._cache.move_to_end(key)
+            return thumbnail
+
+    def submit(self, key, load):
+        """Future of the thumbnail of the photo load() returns; key is its content hash."""
+        with self._lock:
+            thumbnail = self._cache.get(key)
+            if thumbnail is not None:
+                self._cache.move_to_end(key)
+                future = Future()
+                future.set_result(thumbnail)
+                return future
+            error = self._failed.get(key)
+            if error is not None:
+                future = Future()
+                future.set_exception(error)
+                return future
+            future = self._futures.get(key)
+            if future is None:
+                future = self._futures[key] = self._executor.submit(self._make, key, load)
+            return future
+
+    def _make(self, key, load):
+        # Each outcome is recorded before the in-flight entry goes, so no submit() can miss both
+        try:
+            data = load()
+        except Exception:
+            # Not a property of the content (e.g. a scratch file gone): not remembered
+            with self._lock:
+                self._futures.pop(key, None)
+            raise
+        try:
+            thumbnail = make_thumbnail(data)
+        except Exception as e:
+            with self._lock:
+                self._failed[key] = e
+                while len(self._failed) > THUMBNAIL_FAILURES:
+                    self._failed.popitem(last=False)
+                self._futures.pop(key, None)
+            raise
+        with self._lock:
+            self._futures.pop(key, None)
+            if key not in self._cache:
+                self._cache[key] = thumbnail
+                self._size += len(thumbnail)
+            while self._size > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._size -= len(evicted)
+        return thumbnail
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._cache), 'bytes': self._size, 'pending': len(self._futures),
+                    'failed': len(self._failed)}
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Étapes d'un job et libellés affichés dans l'interface
+STAGES = {
+    'queued': "En attente d'un moteur PDF",
+    'html': "Préparation du rapport",
+    'render': "Génération du PDF",
+    'merge': "Ajout de la feuille d'émargement",
+    'done': "PDF prêt",
+    'failed': "Échec de la génération",
+}
+
+# PDFs held by finished jobs, on top of (and possibly duplicating) the PdfCache
+MAX_RESULT_BYTES = 128 * 1024 * 1024
+
+
+class Job:
+    def __init__(self, job_id, meta=None):
+        self.id = job_id
+        self.meta = meta or {}
+        self.stage = 'queued'
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.from_cache = False
+
+    @property
+    def finished(self):
+        return self.stage in ('done', 'failed')
+
+    def elapsed(self):
+        return (self.finished_at or time.time()) - (self.started_at or self.submitted_at)
+
+
+class JobManager:
+    """Runs report generation off the Streamlit script thread.
+
+    Jobs are keyed by the report's content hash, so resubmitting an identical
+    report while it is pending returns the running job instead of a new one,
+    and reruns of the page never cancel anything. Finished jobs are kept for
+    download up to max_finished of them and max_result_bytes of PDFs.
+    """
+
+    def __init__(self, workers=4, max_finished=50, max_result_bytes=MAX_RESULT_BYTES):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_finished = max_finished
+        self.max_result_bytes = max_result_bytes
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def submit(self, job_id, task, meta=None):
+        # task(job) returns the PDF bytes and may update job.stage as it goes
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.stage != 'failed':
+                self._jobs.move_to_end(job_id)
+                return job
+            job = Job(job_id, meta)
+            self._jobs[job_id] = job
+            self._prune()
+        self._executor.submit(self._run, job, task)
+        return job
+
+    def add_finished(self, job_id, result, meta=None):
+        # Register an already available result (e.g. a cache hit) as a done job
+        job = Job(job_id, meta)
+        job.result = result
+        job.from_cache = True
+        job.stage = 'done'
+        job.started_at = job.finished_at = job.submitted_at
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune(keep=job_id)
+        return job
+
+    def _run(self, job, task):
+        job.started_at = time.time()
+        try:
+            job.result = task(job)
+            job.stage = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.stage = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._prune(keep=job.id)
+
+    def _prune(self, keep=None):
+        # Oldest finished jobs go first; the one just finished stays for its download
+        finished = [(job_id, job) for job_id, job in self._jobs.items() if job.finished and job_id != keep]
+        count = len(finished) + (keep in self._jobs)
+        size = sum(len(job.result or b'') for job in self._jobs.values() if job.finished)
+        for job_id, job in finished:
+            if count <= self.max_finished and size <= self.max_result_bytes:
+                break
+            del self._jobs[job_id]
+            count -= 1
+            size -= len(job.result or b'')
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
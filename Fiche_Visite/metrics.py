@@ -0,0 +1,232 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a cached score (sub-ms) up to a slow wkhtmltopdf render
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(_label_key(self.labelnames, labels))
+            return series[2] if series else 0
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    # Value read from a callback at scrape time
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def expose(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning("metric %s failed: %s", self.name, e)
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(value)}"]
+
+
+class Registry:
+    """In-process metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Streamlit re-executes app.py: keep the first instance of a metric
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback):
+        # Gauges follow the latest callback, e.g. a new render pool
+        gauge = self._register(Gauge(name, documentation, callback))
+        gauge.callback = callback
+        return gauge
+
+    def expose(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'br_stage_duration_seconds', "Durée des étapes du cycle de vie d'un rapport.", ['stage']
+)
+STAGE_FAILURES = REGISTRY.counter(
+    'br_stage_failures_total', "Étapes terminées par une exception.", ['stage']
+)
+PDF_RENDERS = REGISTRY.counter('br_pdf_renders_total', "Rendus PDF réussis.")
+PDF_RENDER_FAILURES = REGISTRY.counter('br_pdf_render_failures_total', "Rendus PDF en échec.")
+PDF_CACHE_HITS = REGISTRY.counter(
+    'br_pdf_cache_hits_total', "Rapports servis sans nouveau rendu.", ['source']
+)
+PDF_CACHE_MISSES = REGISTRY.counter('br_pdf_cache_misses_total', "Rapports absents du cache PDF.")
+
+
+@contextmanager
+def span(stage, **fields):
+    """Time a report stage into br_stage_duration_seconds and log it as JSON."""
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if not ok:
+            STAGE_FAILURES.inc(stage=stage)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(
+                dict(fields, stage=stage, seconds=round(elapsed, 6), ok=ok),
+                ensure_ascii=False, default=str
+            ))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port=None, host=None):
+    """Serve /metrics on BR_METRICS_PORT (default 9464, 0 disables) from a daemon thread."""
+    if port is None:
+        try:
+            port = int(os.environ.get('BR_METRICS_PORT', '9464'))
+        except ValueError:
+            port = 9464
+    if not port:
+        return None
+    host = host or os.environ.get('BR_METRICS_HOST', '127.0.0.1')
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint unavailable on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,123 @@
+"""Mise à jour d'une archive de fiches vers le catalogue de critères actuel.
+
+    python Fiche_Visite/migrate.py archive/ -o archive_migree/
+    python Fiche_Visite/migrate.py "archive/visite_chantier_2024*.json" --in-place
+    python Fiche_Visite/migrate.py --store Fiche_Visite/visites.db
+    python Fiche_Visite/migrate.py archive/ --in-place --compact --gzip
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from batch import collect_inputs
+from fiche import CATALOGUE, GZIP_MAGIC, REQUIRED_FIELDS, encode_fiche, gunzip_fiche, parse_fiche
+from visit_store import VisitStore
+
+
+def write_fiche(path, fiche, compact=False, compress=False):
+    # Same encoding as the app's download, written atomically
+    data = encode_fiche(fiche, compact, compress)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_fiche(path):
+    """(fiche, changed, compact, compressed) for a fiche file of either format."""
+    data = Path(path).read_bytes()
+    compressed = data[:2] == GZIP_MAGIC
+    if compressed:
+        data = gunzip_fiche(data)
+    fiche = json.loads(data.decode('utf-8-sig'))
+    if isinstance(fiche, dict) and 'format' in fiche:
+        # Compact fiches store criteria by id: only the version number changes
+        changed = fiche.get('catalogue_version') != CATALOGUE.version
+        return parse_fiche(data), changed, True, compressed
+    missing = [field for field in REQUIRED_FIELDS if field not in fiche] if isinstance(fiche, dict) else ['fiche']
+    if missing:
+        raise ValueError(f"champs manquants : {', '.join(missing)}")
+    return fiche, CATALOGUE.migrate(fiche), False, compressed
+
+
+def output_name(path, compress):
+    name = os.path.basename(path)
+    if compress and not name.endswith('.gz'):
+        return name + '.gz'
+    return name
+
+
+def migrate_files(paths, output_dir=None, compact=False, compress=False):
+    counts = {'migrated': 0, 'current': 0, 'converted': 0, 'failed': 0}
+    errors = []
+    for path in paths:
+        try:
+            fiche, changed, was_compact, was_compressed = read_fiche(path)
+        except (OSError, ValueError) as e:
+            counts['failed'] += 1
+            errors.append({'file': path, 'error': str(e)})
+            continue
+        counts['migrated' if changed else 'current'] += 1
+        # Fiches keep their format unless asked to convert them
+        to_compact = compact or was_compact
+        to_compress = compress or was_compressed
+        converted = to_compact != was_compact or to_compress != was_compressed
+        counts['converted'] += converted
+        target = os.path.join(output_dir or os.path.dirname(path), output_name(path, to_compress))
+        if output_dir or changed or converted:
+            write_fiche(target, fiche, to_compact, to_compress)
+            if not output_dir and target != path:
+                os.remove(path)
+    return counts, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Met à jour des fiches JSON vers le catalogue de critères actuel.")
+    parser.add_argument('inputs', nargs='*', help="dossiers ou motifs glob de fiches visite_chantier_*.json")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('-o', '--output', help="dossier où écrire les fiches mises à jour")
+    target.add_argument('--in-place', action='store_true', help="réécrire les fiches modifiées sur place")
+    parser.add_argument('--compact', action='store_true', help="convertir les fiches au format compact")
+    parser.add_argument('--gzip', action='store_true', help="compresser les fiches (.json.gz)")
+    parser.add_argument('--store', help="base SQLite des visites à mettre à jour")
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.store:
+        parser.error("indiquez des fiches et/ou --store")
+    if args.inputs and not (args.output or args.in_place):
+        parser.error("indiquez -o DOSSIER ou --in-place pour les fiches")
+
+    status = 0
+    start = time.perf_counter()
+    if args.inputs:
+        paths = collect_inputs(args.inputs)
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+        counts, errors = migrate_files(paths, args.output, args.compact, args.gzip)
+        for error in errors:
+            print(f"❌ {os.path.basename(error['file'])} : {error['error']}", file=sys.stderr)
+        print(f"{len(paths)} fiches : {counts['migrated']} mises à jour vers le catalogue {CATALOGUE.version}, "
+              f"{counts['current']} déjà à jour, {counts['failed']} en échec")
+        if counts['converted']:
+            formats = [name for flag, name in ((args.compact, 'compact'), (args.gzip, 'gzip')) if flag]
+            print(f"{counts['converted']} fiches converties ({' + '.join(formats)})")
+        status = 1 if errors else 0
+
+    if args.store:
+        store = VisitStore(args.store)
+        try:
+            changed = store.migrate(CATALOGUE)
+            print(f"{store.count()} visites en base : {changed} mises à jour vers le catalogue {CATALOGUE.version}")
+        finally:
+            store.close()
+
+    print(f"Terminé en {time.perf_counter() - start:.1f}s")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
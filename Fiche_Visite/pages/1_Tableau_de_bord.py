@@ -0,0 +1,95 @@
+import streamlit as st
+
+from fiche import categories
+from metrics import span
+from visit_store import VisitStore, default_path
+
+st.set_page_config(page_title="TABLEAU DE BORD BR CONSULT", layout="wide")
+
+# Même base que la page de saisie ; les tendances sont lues dans les tables de cumuls
+@st.cache_resource
+def get_visit_store():
+    return VisitStore(default_path())
+
+visit_store = get_visit_store()
+
+def client_label(nom):
+    if nom is None:
+        return "Tous les clients"
+    return nom or "Client non renseigné"
+
+def site_label(adresse):
+    if adresse is None:
+        return "Tous les chantiers"
+    return adresse or "Adresse non renseignée"
+
+st.title("📊 Tableau de bord des visites")
+
+col_client, col_site = st.columns(2)
+with col_client:
+    client = st.selectbox("Client", [None] + visit_store.clients(), format_func=client_label)
+with col_site:
+    site = st.selectbox("Chantier", [None] + visit_store.sites(client), format_func=site_label)
+
+mois = visit_store.months(client, site)
+if not mois:
+    st.info("Aucune visite enregistrée pour cette sélection.")
+    st.stop()
+
+if len(mois) > 1:
+    debut, fin = st.select_slider("Période", options=mois, value=(mois[max(0, len(mois) - 12)], mois[-1]))
+else:
+    debut = fin = mois[0]
+
+with span('dashboard', client=client, site=site):
+    filtres = {'nom_client': client, 'adresse': site, 'month_from': debut, 'month_to': fin}
+    tendance = visit_store.score_trend(**filtres)
+    echecs = visit_store.criteria_failures(limit=10, **filtres)
+
+# Une ligne par mois, une colonne par catégorie et pour la note globale
+series = ["Note globale"] + list(categories)
+par_mois = {}
+visites = 0
+for ligne in tendance:
+    notes_mois = par_mois.setdefault(ligne['month'], {})
+    if not ligne['category']:
+        visites += ligne['visits']
+    if ligne['note'] is not None:
+        notes_mois[ligne['category'] or "Note globale"] = ligne
+mois_affiches = sorted(par_mois)
+
+dernier = par_mois[mois_affiches[-1]] if mois_affiches else {}
+precedent = par_mois[mois_affiches[-2]] if len(mois_affiches) > 1 else {}
+colonnes = st.columns(len(series))
+for colonne, serie in zip(colonnes, series):
+    with colonne:
+        actuel = dernier.get(serie)
+        avant = precedent.get(serie)
+        delta = f"{actuel['note'] - avant['note']:+.1f} pt" if actuel and avant else None
+        st.metric(serie, f"{actuel['note']}%" if actuel else "N/A", delta)
+if mois_affiches:
+    st.caption(f"Dernier mois : {mois_affiches[-1]} – {visites} visite(s) sur la période")
+
+st.subheader("📈 Évolution mensuelle des notes")
+st.line_chart(
+    {'Mois': mois_affiches,
+     **{serie: [par_mois[m][serie]['note'] if serie in par_mois[m] else None for m in mois_affiches] for serie in series}},
+    x='Mois',
+    y=series,
+    y_label="Note (%)"
+)
+
+st.subheader("⚠️ Critères les plus souvent non satisfaisants")
+if echecs:
+    st.dataframe(
+        [{
+            'Catégorie': echec['category'],
+            'Critère': echec['label'],
+            'Non satisfaisant': echec['non_satisfaisant'],
+            'Évalué': echec['evaluated'],
+            'Taux': f"{echec['non_satisfaisant'] / echec['evaluated']:.0%}",
+        } for echec in echecs],
+        hide_index=True
+    )
+else:
+    st.success("Aucun critère non satisfaisant sur la période.")
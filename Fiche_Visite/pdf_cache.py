@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def digest(data):
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def report_cache_key(payload, emargement_digest, logo_digest, template_version, engine=None, photo_digests=()):
+    # Stable hash of everything that ends up in the rendered PDF
+    canonical = json.dumps(
+        {
+            'payload': payload,
+            'emargement': emargement_digest,
+            'logo': logo_digest,
+            'template': template_version,
+            'engine': engine,
+            'photos': list(photo_digests),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(',', ':'),
+        default=str,
+    )
+    return digest(canonical)
+
+
+class PdfCache:
+    """LRU cache of rendered PDFs, bounded in bytes, with an optional disk tier."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pdf")
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._store(key, data)
+        self._write_disk(key, data)
+
+    def _store(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._disk_path(key))
+            self._trim_disk()
+        except OSError as e:
+            print(f"PDF cache write failed: {e}")
+
+    def _trim_disk(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.pdf'):
+                st = os.stat(os.path.join(self.disk_dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,24 @@
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.errors import PdfReadError
+
+
+def append_pdf(report_pdf, attachment):
+    # Pages are copied as PDF objects: content streams stay compressed and
+    # nothing is rasterized or sent back through wkhtmltopdf. The reader only
+    # loads the objects each page references, so memory follows the file
+    # sizes rather than the scanned page resolution.
+    try:
+        reader = PdfReader(attachment)
+        if reader.is_encrypted and not reader.decrypt(''):
+            raise ValueError("la feuille d'émargement PDF est protégée par un mot de passe")
+        writer = PdfWriter()
+        writer.append(PdfReader(BytesIO(report_pdf)))
+        writer.append(reader, import_outline=False)
+    except PdfReadError as e:
+        raise ValueError(f"la feuille d'émargement PDF est illisible ({e})")
+
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
@@ -0,0 +1,425 @@
+import os
+import platform
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+import pdfkit
+
+from metrics import span
+from report_assets import ASSETS_DIR
+
+# Options wkhtmltopdf utilisées pour tous les rapports
+PDF_OPTIONS = {
+    'enable-local-file-access': None,
+    'encoding': 'UTF-8',
+    'page-size': 'A4',
+    'margin-top': '0mm',
+    'margin-right': '0mm',
+    'margin-bottom': '0mm',
+    'margin-left': '0mm',
+    'no-outline': None,
+    'print-media-type': None,
+    'dpi': 300
+}
+
+# Anything wkhtmltopdf would fetch over the network: @import and url() in CSS
+# (<style> blocks and style attributes), src and srcset attributes (img, script,
+# iframe, embed...), <object data> and <link href>.
+# Text and plain <a href> links are not fetched and are allowed.
+CSS_EXTERNAL_RE = re.compile(
+    r"""(?:@import\s+(?:url\(\s*)?|url\(\s*)['"]?\s*((?:https?:)?//[^'")\s;]+)""",
+    re.IGNORECASE
+)
+EXTERNAL_URL_RE = re.compile(r"""\s*((?:https?:)?//\S+)""", re.IGNORECASE)
+FETCHED_ATTRIBUTES = {'src', 'poster', 'background'}
+FETCHED_TAG_ATTRIBUTES = {('object', 'data'), ('link', 'href'), ('image', 'href'), ('use', 'href'),
+                          ('image', 'xlink:href'), ('use', 'xlink:href')}
+
+
+class _ResourceFinder(HTMLParser):
+    # Only markup is checked: escaped fiche text is character data, never a tag
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.found = []
+        self._in_style = False
+
+    def handle_starttag(self, tag, attrs):
+        self._in_style = tag == 'style'
+        for name, value in attrs:
+            if not value:
+                continue
+            if name == 'style':
+                self.found.extend(CSS_EXTERNAL_RE.findall(value))
+            elif name == 'srcset':
+                # "url 1x, url 2x": every candidate may be fetched
+                for candidate in value.split(','):
+                    self._check_url(candidate)
+            elif name in FETCHED_ATTRIBUTES or (tag, name) in FETCHED_TAG_ATTRIBUTES:
+                self._check_url(value)
+
+    def _check_url(self, value):
+        match = EXTERNAL_URL_RE.match(value)
+        if match:
+            self.found.append(match.group(1))
+
+    def handle_endtag(self, tag):
+        if tag == 'style':
+            self._in_style = False
+
+    def handle_data(self, data):
+        if self._in_style:
+            self.found.extend(CSS_EXTERNAL_RE.findall(data))
+
+
+class ExternalResourceError(ValueError):
+    pass
+
+
+def find_external_resources(html):
+    finder = _ResourceFinder()
+    finder.feed(html)
+    finder.close()
+    return finder.found
+
+
+def assert_offline(html):
+    external = find_external_resources(html)
+    if external:
+        raise ExternalResourceError(
+            "Le rapport référence des ressources externes : " + ", ".join(sorted(set(external)))
+        )
+
+
+WARMUP_HTML = "<!DOCTYPE html><html><head><meta charset='utf-8'></head><body><p>BR CONSULT</p></body></html>"
+
+
+def configure_wkhtmltopdf():
+    # On Streamlit Cloud, wkhtmltopdf is installed via packages.txt
+    if os.path.exists('/usr/bin/wkhtmltopdf'):
+        return pdfkit.configuration(wkhtmltopdf='/usr/bin/wkhtmltopdf')
+
+    # For Windows local development
+    if platform.system() == 'Windows':
+        windows_paths = [
+            r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe',
+            r'C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe'
+        ]
+        for path in windows_paths:
+            if os.path.exists(path):
+                return pdfkit.configuration(wkhtmltopdf=path)
+
+    # Default configuration
+    try:
+        return pdfkit.configuration()
+    except Exception:
+        return None
+
+
+# wkhtmltopdf writes each PDF to a scratch file named after the rendering
+# process; the file is removed as soon as it has been read back
+SCRATCH_PREFIX = 'render-'
+SCRATCH_MAX_AGE = 3600
+# A report is a few MB; refuse to load anything far beyond that into memory
+MAX_PDF_BYTES = 200 * 1024 * 1024
+
+
+class PdfTooLargeError(RuntimeError):
+    pass
+
+
+def scratch_dir():
+    path = os.environ.get('BR_PDF_SCRATCH_DIR') or os.path.join(tempfile.gettempdir(), 'br_pdf_render')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+
+def clean_scratch(max_age=SCRATCH_MAX_AGE, directory=None):
+    """Remove scratch PDFs left behind by crashed renders; returns how many."""
+    directory = directory or scratch_dir()
+    now = time.time()
+    removed = 0
+    for name in os.listdir(directory):
+        if not name.startswith(SCRATCH_PREFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            pid = int(name[len(SCRATCH_PREFIX):].split('-', 1)[0])
+        except ValueError:
+            pid = None
+        try:
+            # Files of a live process are only removed once clearly stale
+            orphaned = pid is None or not _pid_alive(pid)
+            if orphaned or now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+@contextmanager
+def scratch_file(suffix):
+    # Path in the scratch directory, removed on exit (or by clean_scratch after a crash)
+    fd, path = tempfile.mkstemp(prefix=f"{SCRATCH_PREFIX}{os.getpid()}-", suffix=suffix, dir=scratch_dir())
+    os.close(fd)
+    try:
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def read_pdf(path):
+    with span('read_pdf'), open(path, 'rb') as file:
+        # One allocation of the final size, unlike buffering wkhtmltopdf's stdout
+        size = os.fstat(file.fileno()).st_size
+        if size > MAX_PDF_BYTES:
+            raise PdfTooLargeError(f"PDF de {size // (1024 * 1024)} Mo, au-delà de la limite de rendu")
+        return file.read(size)
+
+
+def render_pdf(html, config, options=None):
+    assert_offline(html)
+    with scratch_file('.pdf') as path:
+        pdfkit.from_string(html, path, configuration=config, options=options or PDF_OPTIONS)
+        return read_pdf(path)
+
+
+def render_pdf_file(html_path, config, options=None):
+    # Large documents: wkhtmltopdf reads the HTML from disk rather than from
+    # a string held in memory; the caller checks it for external resources
+    with scratch_file('.pdf') as path:
+        pdfkit.from_file(html_path, path, configuration=config, options=options or PDF_OPTIONS)
+        return read_pdf(path)
+
+
+class WkhtmltopdfEngine:
+    """pdfkit + wkhtmltopdf, the historical renderer."""
+
+    name = 'wkhtmltopdf'
+    unavailable_message = "wkhtmltopdf n'est pas installé"
+
+    def __init__(self, config=None, options=None):
+        self.config = configure_wkhtmltopdf() if config is None else config
+        self.options = options or PDF_OPTIONS
+
+    @property
+    def available(self):
+        return self.config is not None
+
+    def warmup(self):
+        # Loads the binary, Qt libraries and fontconfig cache
+        pdfkit.from_string(WARMUP_HTML, False, configuration=self.config, options={'quiet': None})
+
+    def render(self, html):
+        return render_pdf(html, self.config, self.options)
+
+    def render_file(self, html_path):
+        return render_pdf_file(html_path, self.config, self.options)
+
+
+# Same page geometry as the wkhtmltopdf options: A4 without printer margins,
+# the .page-wrapper margins do the spacing. WeasyPrint adds this sheet with user
+# origin, so !important is needed to beat the template's own @page margins.
+WEASYPRINT_PAGE_CSS = "@page { size: A4 !important; margin: 0 !important; }"
+
+
+def offline_url_fetcher(base):
+    """Instance of a subclass of WeasyPrint's URLFetcher that only reads file: and data: URLs."""
+
+    class OfflineURLFetcher(base):
+        def fetch(self, url, headers=None):
+            # Fonts and images must come from disk or data: URIs, as with wkhtmltopdf
+            if not url.lower().startswith(('file:', 'data:')):
+                raise ExternalResourceError(f"Le rapport référence une ressource externe : {url}")
+            return super().fetch(url, headers)
+
+    return OfflineURLFetcher(allowed_protocols={'file', 'data'})
+
+
+class WeasyPrintEngine:
+    """WeasyPrint, rendering in-process without an external binary."""
+
+    name = 'weasyprint'
+
+    def __init__(self):
+        try:
+            import weasyprint
+        except (ImportError, OSError) as e:
+            # OSError: the Python package is there but Pango is not
+            weasyprint = None
+            self.unavailable_message = f"WeasyPrint n'est pas disponible ({e})"
+        self._weasyprint = weasyprint
+        self._page_css = weasyprint.CSS(string=WEASYPRINT_PAGE_CSS) if weasyprint else None
+
+    @property
+    def available(self):
+        return self._weasyprint is not None
+
+    def _fetcher(self):
+        # A fetcher keeps per-request state, so each render gets its own
+        return offline_url_fetcher(self._weasyprint.urls.URLFetcher)
+
+    def warmup(self):
+        self.render(WARMUP_HTML)
+
+    def render(self, html):
+        assert_offline(html)
+        document = self._weasyprint.HTML(string=html, base_url=str(ASSETS_DIR), url_fetcher=self._fetcher())
+        return document.write_pdf(stylesheets=[self._page_css])
+
+    def render_file(self, html_path):
+        document = self._weasyprint.HTML(filename=html_path, base_url=str(ASSETS_DIR), url_fetcher=self._fetcher())
+        return document.write_pdf(stylesheets=[self._page_css])
+
+
+ENGINES = {
+    WkhtmltopdfEngine.name: WkhtmltopdfEngine,
+    WeasyPrintEngine.name: WeasyPrintEngine,
+}
+DEFAULT_ENGINE = WkhtmltopdfEngine.name
+
+
+def get_engine(name=None):
+    """Report renderer selected by name or by BR_PDF_ENGINE (default wkhtmltopdf)."""
+    name = (name or os.environ.get('BR_PDF_ENGINE') or DEFAULT_ENGINE).strip().lower()
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Moteur PDF inconnu : {name} (disponibles : {', '.join(ENGINES)})")
+
+
+def default_pool_size():
+    try:
+        return max(1, int(os.environ.get('BR_PDF_WORKERS', '')))
+    except ValueError:
+        return max(1, min(4, os.cpu_count() or 1))
+
+
+class RenderPool:
+    """Bounded pool of PDF render workers shared by every Streamlit session.
+
+    wkhtmltopdf has no server mode, so each job still runs the binary; the
+    pool caps how many engines boot at once and keeps the engine warm with a
+    render at start-up.
+    """
+
+    def __init__(self, engine, size=None, warmup=True, janitor_interval=600):
+        self.engine = engine
+        self.size = size or default_pool_size()
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="pdf-render")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._latencies = deque(maxlen=200)
+        self._waits = deque(maxlen=200)
+        if warmup and engine.available:
+            self._executor.submit(self._warmup)
+        self._janitor = None
+        if janitor_interval:
+            self._janitor = threading.Thread(
+                target=self._run_janitor, args=(janitor_interval,), name="pdf-janitor", daemon=True
+            )
+            self._janitor.start()
+
+    def _run_janitor(self, interval):
+        # Sweep at start-up (files of a previous crashed server), then periodically
+        while True:
+            try:
+                removed = clean_scratch()
+                if removed:
+                    print(f"PDF janitor removed {removed} orphaned scratch file(s)")
+            except OSError as e:
+                print(f"PDF janitor failed: {e}")
+            time.sleep(interval)
+
+    def _warmup(self):
+        try:
+            self.engine.warmup()
+        except Exception as e:
+            print(f"PDF warm-up failed: {e}")
+
+    def submit(self, html):
+        # Fail before queuing rather than stalling a worker on a network timeout
+        assert_offline(html)
+        return self._submit(self.engine.render, html)
+
+    def submit_file(self, html_path):
+        # HTML already written (and checked) on disk, e.g. a consolidated report
+        return self._submit(self.engine.render_file, html_path)
+
+    def _submit(self, render, source):
+        if not self.engine.available:
+            raise RuntimeError(self.engine.unavailable_message)
+        with self._lock:
+            self._queued += 1
+        return self._executor.submit(self._render, render, source, time.perf_counter())
+
+    def render(self, html, timeout=None):
+        return self.submit(html).result(timeout=timeout)
+
+    def render_file(self, html_path, timeout=None):
+        return self.submit_file(html_path).result(timeout=timeout)
+
+    def _render(self, render, source, submitted_at):
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        ok = False
+        try:
+            pdf_bytes = render(source)
+            ok = True
+            return pdf_bytes
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._waits.append(started - submitted_at)
+                self._latencies.append(finished - started)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            waits = list(self._waits)
+            stats = {
+                'engine': self.engine.name,
+                'pool_size': self.size,
+                'queue_depth': self._queued,
+                'in_flight': self._running,
+                'completed': self._completed,
+                'failed': self._failed,
+                'last_latency': self._latencies[-1] if self._latencies else None,
+            }
+        if latencies:
+            stats['p50_latency'] = latencies[len(latencies) // 2]
+            stats['p95_latency'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            stats['avg_wait'] = sum(waits) / len(waits)
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
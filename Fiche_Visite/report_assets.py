@@ -0,0 +1,59 @@
+import base64
+from functools import lru_cache
+from pathlib import Path
+
+ASSETS_DIR = Path(__file__).parent / 'assets'
+FONTS_DIR = ASSETS_DIR / 'fonts'
+
+# (famille, graisse, fichier TTF, nom PostScript pour local())
+FONT_FACES = [
+    ('Montserrat', 300, 'Montserrat-Light.ttf', 'Montserrat-Light'),
+    ('Montserrat', 400, 'Montserrat-Regular.ttf', 'Montserrat-Regular'),
+    ('Montserrat', 600, 'Montserrat-SemiBold.ttf', 'Montserrat-SemiBold'),
+    ('Montserrat', 700, 'Montserrat-Bold.ttf', 'Montserrat-Bold'),
+    ('Open Sans', 300, 'OpenSans-Light.ttf', 'OpenSans-Light'),
+    ('Open Sans', 400, 'OpenSans-Regular.ttf', 'OpenSans-Regular'),
+    ('Open Sans', 600, 'OpenSans-SemiBold.ttf', 'OpenSans-SemiBold'),
+]
+
+
+@lru_cache(maxsize=2)
+def font_face_css(embed=False):
+    # Fonts are resolved from the system (packages.txt) or from assets/fonts,
+    # never from the network. embed=True inlines the files for contexts that
+    # cannot read file:// URLs (browser preview).
+    rules = []
+    for family, weight, filename, postscript in FONT_FACES:
+        sources = [f"local('{family} {postscript.split('-')[-1]}')", f"local('{postscript}')"]
+        path = FONTS_DIR / filename
+        if path.exists():
+            if embed:
+                data = base64.b64encode(path.read_bytes()).decode('ascii')
+                sources.append(f"url(data:font/ttf;base64,{data}) format('truetype')")
+            else:
+                sources.append(f"url('{path.resolve().as_uri()}') format('truetype')")
+        rules.append(
+            "@font-face {\n"
+            f"    font-family: '{family}';\n"
+            "    font-style: normal;\n"
+            f"    font-weight: {weight};\n"
+            f"    src: {', '.join(sources)};\n"
+            "}"
+        )
+    return "\n".join(rules)
+
+
+def get_logo_from_file():
+    # Get the absolute path to the logo file
+    logo_path = ASSETS_DIR / 'logo_br.jpg'
+
+    try:
+        with open(logo_path, 'rb') as image_file:
+            return base64.b64encode(image_file.read()).decode('utf-8')
+    except Exception as e:
+        print(f"Error loading logo: {e}")
+        return None
+
+
+def missing_fonts():
+    return [filename for _, _, filename, _ in FONT_FACES if not (FONTS_DIR / filename).exists()]
@@ -0,0 +1,786 @@
+import html
+from datetime import date, datetime
+from functools import lru_cache
+
+from catalogue import eval_key, obs_key
+from report_assets import font_face_css
+from scoring import category_notes, compute_scores
+
+# Bump whenever the report HTML/CSS changes so cached PDFs are invalidated
+TEMPLATE_VERSION = "7"
+
+# Static part of the stylesheet, shared by every report
+REPORT_CSS = """
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+@page {
+    size: A4;
+    margin: 5mm 5mm 5mm 5mm;
+}
+
+body {
+    font-family: 'Open Sans', Arial, sans-serif;
+    line-height: 1.6;
+    color: #2c2c2c;
+    background: #ffffff;
+    width: 100%;
+    margin: 0;
+    padding: 0;
+}
+
+.container {
+    width: 100%;
+    margin: 0 auto;
+    background: white;
+    padding: 0;
+}
+
+/* Wrapper for page content with borders */
+.page-wrapper {
+    border: 2px solid #dc2626;
+    border-radius: 8px;
+    margin: 5mm;
+    padding: 15px;
+    min-height: calc(297mm - 20mm);
+    position: relative;
+    page-break-inside: avoid;
+    page-break-after: always;
+}
+
+.page-wrapper:last-child {
+    page-break-after: avoid;
+}
+
+/* Header with title for first page only */
+.header-with-title {
+    background: #ffffff;
+    color: #000000;
+    padding: 15px 30px 20px 30px;
+    position: relative;
+    min-height: 120px;
+    margin: -15px -15px 20px -15px;
+    border-bottom: 3px solid #dc2626;
+    border-radius: 6px 6px 0 0;
+}
+
+/* Header with logo only for other pages */
+.header-logo-only {
+    position: absolute;
+    top: 15px;
+    left: 30px;
+    z-index: 10;
+}
+
+.logo-container {
+    position: absolute;
+    left: 30px;
+    top: 15px;
+}
+
+.page-title {
+    font-family: 'Montserrat', sans-serif;
+    font-size: 2em;
+    font-weight: 700;
+    letter-spacing: 1px;
+    color: #000000;
+    text-transform: uppercase;
+    text-align: center;
+    padding-top: 60px;
+}
+
+/* Content sections */
+.content {
+    padding: 0 10px;
+}
+
+.content-with-logo {
+    padding: 80px 10px 10px 10px;
+}
+
+.section {
+    margin-bottom: 15px;
+    padding: 15px;
+    background: #fafafa;
+    border-radius: 6px;
+    border: 1px solid #e5e5e5;
+    position: relative;
+    page-break-inside: avoid;
+}
+
+.section::before {
+    content: '';
+    position: absolute;
+    left: 0;
+    top: 0;
+    bottom: 0;
+    width: 3px;
+    background: #dc2626;
+    border-radius: 6px 0 0 6px;
+}
+
+.section-title {
+    color: #000000;
+    font-family: 'Montserrat', sans-serif;
+    font-size: 1.4em;
+    font-weight: 600;
+    margin-bottom: 20px;
+    padding-bottom: 10px;
+    border-bottom: 2px solid #dc2626;
+    display: flex;
+    align-items: center;
+}
+
+.icon {
+    margin-right: 10px;
+    font-size: 1em;
+    color: #dc2626;
+}
+
+/* Info grid */
+.info-grid {
+    display: grid;
+    grid-template-columns: repeat(2, 1fr);
+    gap: 15px;
+    margin-bottom: 15px;
+}
+
+.info-item {
+    padding: 12px;
+    background: white;
+    border-radius: 5px;
+    border: 1px solid #e5e5e5;
+}
+
+.info-label {
+    font-weight: 600;
+    color: #666666;
+    font-size: 0.8em;
+    text-transform: uppercase;
+    letter-spacing: 0.5px;
+    margin-bottom: 4px;
+}
+
+.info-value {
+    color: #000000;
+    font-size: 1em;
+    font-weight: 500;
+}
+
+/* Photos link section */
+.photos-link-box {
+    background: #e3f2fd;
+    border: 2px solid #1976d2;
+    border-radius: 6px;
+    padding: 15px;
+    margin: 15px 0;
+    text-align: center;
+}
+
+.photos-link-box a {
+    color: #1976d2;
+    font-weight: 600;
+    text-decoration: none;
+    font-size: 0.85em;
+    word-break: break-all;
+    display: inline-block;
+    max-width: 100%;
+}
+
+/* Contact sheet: fixed table layout, which every PDF engine paginates alike */
+.contact-sheet {
+    width: 100%;
+    border-collapse: separate;
+    border-spacing: 8px;
+    table-layout: fixed;
+}
+
+.contact-sheet td {
+    text-align: center;
+    vertical-align: top;
+    height: 185px;
+}
+
+.contact-sheet img {
+    max-width: 200px;
+    max-height: 150px;
+    border-radius: 4px;
+}
+
+.contact-sheet .photo-caption {
+    font-size: 0.7em;
+    color: #6c757d;
+    word-break: break-all;
+}
+
+/* Results presentation style */
+.results-grid {
+    display: grid;
+    grid-template-columns: repeat(3, 1fr);
+    gap: 20px;
+    margin: 20px 0;
+    text-align: center;
+}
+
+.result-item {
+    padding: 25px 15px;
+    background: white;
+    border-radius: 6px;
+    border: 2px solid #e5e5e5;
+}
+
+.result-category {
+    font-family: 'Montserrat', sans-serif;
+    font-size: 0.95em;
+    font-weight: 700;
+    text-transform: uppercase;
+    letter-spacing: 0.8px;
+    color: #2c2c2c;
+    margin-bottom: 10px;
+}
+
+.result-score {
+    font-family: 'Montserrat', sans-serif;
+    font-size: 2.8em;
+    font-weight: 700;
+    color: #dc2626;
+    line-height: 1;
+}
+
+/* Global score - BR CONSULT style */
+.global-score {
+    text-align: center;
+    padding: 30px;
+    background: #000000;
+    color: white;
+    border-radius: 8px;
+    margin: 30px 0;
+    position: relative;
+}
+
+.score-value {
+    font-family: 'Montserrat', sans-serif;
+    font-size: 3.5em;
+    font-weight: 700;
+    margin: 0;
+    color: white;
+    display: inline;
+}
+
+.score-label {
+    font-family: 'Open Sans', sans-serif;
+    font-size: 1.1em;
+    font-weight: 400;
+    letter-spacing: 1px;
+    text-transform: uppercase;
+    margin-bottom: 15px;
+}
+
+/* Category headers */
+.category-header {
+    font-family: 'Montserrat', sans-serif;
+    color: #000000;
+    margin: 10px 0 10px 0;
+    font-size: 1.3em;
+    font-weight: 600;
+    padding-left: 12px;
+    border-left: 3px solid #dc2626;
+}
+
+/* Criteria table - BR CONSULT style */
+.criteria-table {
+    width: 100%;
+    border-collapse: collapse;
+    margin-top: 10px;
+    margin-bottom: 15px;
+    background: white;
+    border-radius: 6px;
+    overflow: hidden;
+    box-shadow: 0 1px 5px rgba(0,0,0,0.05);
+}
+
+.criteria-table th {
+    background: #2c2c2c;
+    color: white;
+    padding: 15px 12px;
+    text-align: left;
+    font-weight: 600;
+    font-size: 0.9em;
+    letter-spacing: 0.5px;
+}
+
+.criteria-table th:first-child {
+    border-left: 3px solid #dc2626;
+}
+
+.criteria-table td {
+    padding: 12px;
+    border-bottom: 1px solid #f0f0f0;
+    background: white;
+    font-size: 0.9em;
+}
+
+.criteria-table tr:last-child td {
+    border-bottom: none;
+}
+
+/* Status badges - BR CONSULT style */
+.status {
+    display: inline-block;
+    padding: 5px 12px;
+    border-radius: 15px;
+    font-size: 0.8em;
+    font-weight: 600;
+    text-align: center;
+    min-width: 120px;
+    letter-spacing: 0.2px;
+}
+
+.status-satisfaisant {
+    background: #dcfce7;
+    color: #166534;
+    border: 1px solid #bbf7d0;
+}
+
+.status-partiellement {
+    background: #fef3c7;
+    color: #92400e;
+    border: 1px solid #fde68a;
+}
+
+.status-non-satisfaisant {
+    background: #fee2e2;
+    color: #991b1b;
+    border: 1px solid #fecaca;
+}
+
+.status-na {
+    background: #f3f4f6;
+    color: #4b5563;
+    border: 1px solid #e5e7eb;
+}
+
+/* Observations */
+.observation {
+    font-style: italic;
+    color: #6b7280;
+    font-size: 0.85em;
+    margin-top: 3px;
+    line-height: 1.3;
+}
+
+/* Work types - BR CONSULT style */
+.work-tags {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 8px;
+    margin-top: 12px;
+}
+
+.work-tag {
+    background: #fee2e2;
+    color: #dc2626;
+    padding: 6px 15px;
+    border-radius: 20px;
+    font-size: 0.85em;
+    font-weight: 600;
+    border: 1px solid #fecaca;
+}
+
+/* Print styles */
+@media print {
+    body {
+        background: white;
+        margin: 0;
+        padding: 0;
+    }
+
+    .page-wrapper {
+        border: 2px solid #dc2626;
+        margin: 5mm;
+        page-break-inside: avoid;
+    }
+
+    .container {
+        width: 100%;
+    }
+
+    .section {
+        page-break-inside: avoid;
+    }
+
+    .criteria-table {
+        page-break-inside: auto;
+    }
+
+    .criteria-table tr {
+        page-break-inside: avoid;
+    }
+}
+"""
+
+LOGO_CSS = """
+.br-logo {
+    width: 60px;
+    height: 60px;
+    display: block;
+    background-image: url(data:image/jpeg;base64,%s);
+    background-repeat: no-repeat;
+    -webkit-background-size: 60px 60px;
+    background-size: 60px 60px;
+}
+"""
+
+STATUS_CLASSES = {
+    "Satisfaisant": "status-satisfaisant",
+    "Partiellement Satisfaisant": "status-partiellement",
+    "Non Satisfaisant": "status-non-satisfaisant",
+}
+
+# (libellé, champ) des informations générales, dans l'ordre du rapport
+INFO_FIELDS = [
+    ("Nom du client", 'nom_client'),
+    ("Date de visite", 'date'),
+    ("Heure de visite", 'heure'),
+    ("Adresse du chantier", 'adresse'),
+    ("Effectif sur site", 'effectif'),
+    ("Conducteur de travaux", 'conducteur'),
+    ("Chef de chantier", 'chef_chantier'),
+    ("Contact chantier", 'contact_chantier'),
+    ("Rédacteur du rapport", 'redacteur_rapport'),
+    ("Présence sous-traitant", 'presence_sst'),
+]
+
+# Screen-only additions for the in-app preview: each .page-wrapper is drawn
+# as an A4 sheet, the way wkhtmltopdf paginates the report
+PREVIEW_CSS = """
+html {
+    background: #e5e7eb;
+}
+
+body {
+    background: transparent;
+    padding: 8px 0;
+}
+
+.container {
+    width: 210mm;
+    background: transparent;
+}
+
+.page-wrapper {
+    background: #ffffff;
+    min-height: 287mm;
+    margin: 0 0 8mm 0;
+    box-shadow: 0 2px 10px rgba(0, 0, 0, 0.15);
+}
+"""
+
+HEADER_LOGO = '<div class="header-logo-only"><div class="br-logo"></div></div>'
+
+# Contact sheet grid: 3 x 4 thumbnails per A4 page
+PHOTOS_PER_ROW = 3
+PHOTOS_PER_PAGE = 12
+
+CRITERIA_TABLE_HEAD = """
+<table class="criteria-table">
+    <thead>
+        <tr>
+            <th style="width: 40%;">Critère</th>
+            <th style="width: 25%;">Évaluation</th>
+            <th style="width: 35%;">Observations</th>
+        </tr>
+    </thead>
+    <tbody>"""
+
+CRITERIA_TABLE_FOOT = """
+    </tbody>
+</table>"""
+
+
+def esc(value):
+    return html.escape(str(value), quote=True)
+
+
+@lru_cache(maxsize=4)
+def stylesheet(logo_base64=None, preview=False):
+    # The logo is embedded once, in the stylesheet, and every page header
+    # references it through the .br-logo class
+    parts = [font_face_css(embed=preview)]
+    if logo_base64:
+        parts.append(LOGO_CSS % logo_base64)
+    if preview:
+        # The browser shows the screen media: apply the print rules as well
+        parts.append(REPORT_CSS.replace('@media print', '@media all'))
+        parts.append(PREVIEW_CSS)
+    else:
+        parts.append(REPORT_CSS)
+    return "\n".join(parts)
+
+
+def format_date(value):
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d').date()
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%d/%m/%Y')
+    return str(value)
+
+
+def info_value(data, field):
+    value = data.get(field, '')
+    if field == 'date':
+        return format_date(value)
+    if field == 'heure':
+        return value or 'Non renseignée'
+    if field == 'effectif':
+        return f"{value} personnes"
+    return value
+
+
+def section(icon, title, body, style=''):
+    style_attr = f' style="{style}"' if style else ''
+    return (
+        f'<div class="section"{style_attr}>'
+        f'<h2 class="section-title"><span class="icon">{icon}</span>{title}</h2>'
+        f'{body}</div>'
+    )
+
+
+def general_page(data, logo):
+    parts = ['<div class="page-wrapper"><div class="header-with-title">']
+    if logo:
+        parts.append('<div class="logo-container"><div class="br-logo"></div></div>')
+    parts.append('<div class="page-title">RAPPORT DE VISITE CHANTIER</div></div><div class="content">')
+
+    items = "".join(
+        f'<div class="info-item"><div class="info-label">{label}</div>'
+        f'<div class="info-value">{esc(info_value(data, field))}</div></div>'
+        for label, field in INFO_FIELDS
+    )
+    parts.append(section("📋", "Informations Générales", f'<div class="info-grid">{items}</div>'))
+
+    travaux = list(data.get('travaux_selectionnes') or [])
+    if data.get('travaux_autres'):
+        travaux.append(data['travaux_autres'])
+    tags = "".join(f'<span class="work-tag">{esc(travail)}</span>' for travail in travaux)
+    parts.append(section("🔨", "Type de Travaux", f'<div class="work-tags">{tags}</div>'))
+
+    if data.get('theme_visite'):
+        parts.append(section("🎯", "Thème de la Visite", f"<p>{esc(data['theme_visite'])}</p>"))
+    if data.get('evaluation_generale'):
+        parts.append(section("📝", "Évaluation Générale", f"<p>{esc(data['evaluation_generale'])}</p>"))
+    if data.get('lien_photos'):
+        lien = esc(data['lien_photos'])
+        parts.append(section("📸", "Photos du Chantier", (
+            '<div class="photos-link-box">'
+            '<p style="margin-bottom: 8px;">Les photos du chantier sont disponibles via le lien suivant :</p>'
+            f'<a href="{lien}" target="_blank">{lien}</a></div>'
+        )))
+
+    parts.append('</div></div>')
+    return parts
+
+
+def scores_page(notes_finales, note_chantier, logo):
+    results = "".join(
+        '<div class="result-item">'
+        f'<div class="result-category">{esc(cat.upper())}</div>'
+        f'<div class="result-score">{f"{note}%" if isinstance(note, int) else "N/A"}</div>'
+        '</div>'
+        for cat, note in notes_finales.items()
+    )
+    body = (
+        f'<div class="results-grid">{results}</div>'
+        '<div class="global-score">'
+        '<div class="score-label">Note Globale du Chantier</div>'
+        f'<div class="score-value">{esc(note_chantier)}%</div>'
+        '</div>'
+    )
+    return [
+        '<div class="page-wrapper">',
+        HEADER_LOGO if logo else '',
+        '<div class="content-with-logo">',
+        section("📊", "Résultats de l'Évaluation", body),
+        '</div></div>',
+    ]
+
+
+def emargement_block(emargement_base64, emargement_pdf):
+    if emargement_base64:
+        content = (
+            '<div style="text-align: center; margin: 15px 0;">'
+            f'<img src="data:image/jpeg;base64,{emargement_base64}" style="max-width: 100%; max-height: 400px; '
+            'border-radius: 6px; box-shadow: 0 2px 8px rgba(0,0,0,0.1);"></div>'
+        )
+    elif emargement_pdf:
+        content = (
+            '<p style="text-align: center; padding: 20px; background: #f8f9fa; border-radius: 6px;">'
+            '<span style="font-size: 1.1em;">📎 La feuille d\'émargement (PDF) est jointe en annexe, à la suite de ce rapport</span></p>'
+        )
+    else:
+        content = (
+            '<p style="text-align: center; padding: 20px; background: #f8f9fa; border-radius: 6px; color: #6c757d;">'
+            'Aucune feuille d\'émargement ajoutée</p>'
+        )
+    return (
+        '<div style="margin-top: 20px;">'
+        '<h2 class="section-title" style="margin-bottom: 15px;"><span class="icon">✍️</span>'
+        'Feuille d\'Émargement - Sensibilisation</h2>'
+        f'{content}</div>'
+    )
+
+
+def criteria_pages(data, categories, logo, emargement_base64, emargement_pdf, emargement=True):
+    header = HEADER_LOGO if logo else ''
+    parts = [
+        f'<div class="page-wrapper">{header}<div class="content-with-logo"><div class="section">'
+        '<h2 class="section-title"><span class="icon">🔍</span>Détail des Critères d\'Évaluation</h2>'
+    ]
+    last = len(categories) - 1
+    for idx, (cat, criteres) in enumerate(categories.items()):
+        # Start a new page for each category except the first one
+        if idx > 0:
+            parts.append(
+                f'</div></div></div><div class="page-wrapper">{header}'
+                '<div class="content-with-logo"><div class="section" style="margin-bottom: 10px;">'
+            )
+        parts.append(
+            f'<h3 class="category-header" style="margin-top: 10px; margin-bottom: 10px;">{esc(cat)}</h3>'
+        )
+        parts.append(CRITERIA_TABLE_HEAD)
+        for crit in criteres:
+            note = data.get(eval_key(cat, crit), "Non noté")
+            obs = data.get(obs_key(cat, crit), "")
+            parts.append(
+                f'<tr><td>{esc(crit)}</td>'
+                f'<td><span class="status {STATUS_CLASSES.get(note, "status-na")}">{esc(note)}</span></td>'
+                f'<td><span class="observation">{esc(obs) if obs else "-"}</span></td></tr>'
+            )
+        parts.append(CRITERIA_TABLE_FOOT)
+
+        # Attendance sheet directly after the last category
+        if emargement and idx == last:
+            parts.append(emargement_block(emargement_base64, emargement_pdf))
+    parts.append('</div></div></div>')
+    return parts
+
+
+def contact_sheet_pages(photos, logo):
+    # photos: (caption, JPEG thumbnail base64), PHOTOS_PER_PAGE per page
+    header = HEADER_LOGO if logo else ''
+    pages = (len(photos) + PHOTOS_PER_PAGE - 1) // PHOTOS_PER_PAGE
+    parts = []
+    for page in range(pages):
+        chunk = photos[page * PHOTOS_PER_PAGE:(page + 1) * PHOTOS_PER_PAGE]
+        title = "Planche Photos" + (f" ({page + 1}/{pages})" if pages > 1 else "")
+        rows = []
+        for start in range(0, len(chunk), PHOTOS_PER_ROW):
+            cells = "".join(
+                f'<td><img src="data:image/jpeg;base64,{thumbnail}">'
+                f'<div class="photo-caption">{esc(caption)}</div></td>'
+                for caption, thumbnail in chunk[start:start + PHOTOS_PER_ROW]
+            )
+            cells += '<td></td>' * (PHOTOS_PER_ROW - len(chunk[start:start + PHOTOS_PER_ROW]))
+            rows.append(f"<tr>{cells}</tr>")
+        parts.append(
+            f'<div class="page-wrapper">{header}<div class="content-with-logo">'
+            + section("📸", title, f'<table class="contact-sheet">{"".join(rows)}</table>')
+            + '</div></div>'
+        )
+    return parts
+
+
+def build_report_html(data, notes_finales, note_chantier, categories, logo_base64=None,
+                      emargement_base64=None, emargement_pdf=False, preview=False, photos=None):
+    logo = bool(logo_base64)
+    parts = [
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><style>',
+        stylesheet(logo_base64, preview),
+        '</style></head><body><div class="container">',
+    ]
+    parts.extend(general_page(data, logo))
+    parts.extend(scores_page(notes_finales, note_chantier, logo))
+    parts.extend(criteria_pages(data, categories, logo, emargement_base64, emargement_pdf))
+    if photos:
+        parts.extend(contact_sheet_pages(photos, logo))
+    parts.append('</div></body></html>')
+    return "".join(parts)
+
+
+def build_fiche_html(fiche, categories, logo_base64=None, **kwargs):
+    # Report for a saved fiche, scored the same way as in the app
+    notes_finales, note_chantier = compute_scores(category_notes(fiche, categories))
+    return build_report_html(fiche, notes_finales, note_chantier, categories, logo_base64=logo_base64, **kwargs)
+
+
+def score_cell(note, suffix='%'):
+    return f"{note}{suffix}" if isinstance(note, (int, float)) else "N/A"
+
+
+def cover_page(info, rows, categories, logo):
+    # rows: one dict per visit, in date order, with date, adresse, notes, note
+    parts = ['<div class="page-wrapper"><div class="header-with-title">']
+    if logo:
+        parts.append('<div class="logo-container"><div class="br-logo"></div></div>')
+    parts.append('<div class="page-title">RAPPORT CONSOLIDÉ DES VISITES</div></div><div class="content">')
+
+    items = "".join(
+        f'<div class="info-item"><div class="info-label">{label}</div>'
+        f'<div class="info-value">{esc(value)}</div></div>'
+        for label, value in info
+    )
+    parts.append(section("📋", "Synthèse", f'<div class="info-grid">{items}</div>'))
+
+    head = "".join(f"<th>{esc(cat)}</th>" for cat in categories)
+    parts.append(
+        '<div class="section"><h2 class="section-title"><span class="icon">📈</span>Évolution des notes</h2>'
+        '<table class="criteria-table"><thead><tr><th>Date</th><th>Adresse</th>'
+        f'{head}<th>Note globale</th><th>Évolution</th></tr></thead><tbody>'
+    )
+    previous = None
+    for row in rows:
+        note = row['note']
+        trend = "-"
+        if isinstance(note, (int, float)) and isinstance(previous, (int, float)):
+            trend = f"{note - previous:+.1f} pt"
+        if isinstance(note, (int, float)):
+            previous = note
+        cells = "".join(f"<td>{score_cell(row['notes'].get(cat))}</td>" for cat in categories)
+        parts.append(
+            f"<tr><td>{esc(format_date(row['date']))}</td><td>{esc(row['adresse'])}</td>"
+            f"{cells}<td><strong>{score_cell(note)}</strong></td><td>{trend}</td></tr>"
+        )
+    parts.append('</tbody></table></div></div></div>')
+    return parts
+
+
+def write_consolidated_html(out, info, rows, fiches, categories, logo_base64=None, check=None):
+    """Write a multi-visit report to the text file out, one visit at a time.
+
+    rows are the per-visit scores shown on the cover; fiches yields the
+    matching saved fiches lazily, so only one visit's HTML is held in memory.
+    check(html) is called on every chunk before it is written.
+    """
+    logo = bool(logo_base64)
+
+    def write(parts):
+        chunk = "".join(parts)
+        if check is not None:
+            check(chunk)
+        out.write(chunk)
+
+    write([
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><style>',
+        stylesheet(logo_base64),
+        '</style></head><body><div class="container">',
+    ])
+    write(cover_page(info, rows, categories, logo))
+    for row, fiche in zip(rows, fiches):
+        parts = general_page(fiche, logo)
+        parts.extend(scores_page(row['notes'], row['note'], logo))
+        parts.extend(criteria_pages(fiche, categories, logo, None, False, emargement=False))
+        write(parts)
+    write(['</div></body></html>'])
@@ -0,0 +1,169 @@
+import json
+from collections import defaultdict
+
+import numpy as np
+
+from catalogue import CatalogueError
+from scoring import evaluation_matrix, score_matrix
+
+# Per client, site and month sums kept next to the visits table, so trends
+# are read from a few hundred rows instead of re-scoring every fiche.
+# category '' holds the global note (note_chantier); visits counts every
+# visit, scored only those where the category was not "NA".
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_scores (
+    nom_client TEXT NOT NULL COLLATE NOCASE,
+    adresse TEXT NOT NULL COLLATE NOCASE,
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    total REAL NOT NULL,
+    scored INTEGER NOT NULL,
+    visits INTEGER NOT NULL,
+    PRIMARY KEY (nom_client, adresse, month, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_criteria (
+    nom_client TEXT NOT NULL COLLATE NOCASE,
+    adresse TEXT NOT NULL COLLATE NOCASE,
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    label TEXT NOT NULL,
+    non_satisfaisant INTEGER NOT NULL,
+    evaluated INTEGER NOT NULL,
+    PRIMARY KEY (nom_client, adresse, month, category, label)
+) WITHOUT ROWID;
+"""
+
+GLOBAL = ''
+
+_ADD_SCORES = (
+    "INSERT INTO rollup_scores (nom_client, adresse, month, category, total, scored, visits) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT DO UPDATE SET total = total + excluded.total, scored = scored + excluded.scored, "
+    "visits = visits + excluded.visits"
+)
+_ADD_CRITERIA = (
+    "INSERT INTO rollup_criteria (nom_client, adresse, month, category, label, non_satisfaisant, evaluated) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT DO UPDATE SET non_satisfaisant = non_satisfaisant + excluded.non_satisfaisant, "
+    "evaluated = evaluated + excluded.evaluated"
+)
+
+
+def rollup_payload(data, catalogue):
+    # Stored JSON (or a fiche dict, left untouched) as the current catalogue sees it;
+    # None if it cannot be read
+    try:
+        payload = json.loads(data) if isinstance(data, str) else dict(data)
+        catalogue.migrate(payload)
+    except (ValueError, CatalogueError):
+        return None
+    return payload
+
+
+def contributions(payloads, catalogue):
+    """Score and criteria sums of a batch of fiches, keyed like the rollup tables."""
+    scores = defaultdict(lambda: [0.0, 0, 0])
+    criteria = defaultdict(lambda: [0, 0])
+    if not payloads:
+        return scores, criteria
+    codes = evaluation_matrix(payloads, catalogue.categories)
+    notes_finales, note_chantier = score_matrix(codes, catalogue.categories)
+    failed = codes == 1
+    evaluated = codes > 0
+    for j, payload in enumerate(payloads):
+        dims = (str(payload.get('nom_client') or ''), str(payload.get('adresse') or ''),
+                str(payload.get('date') or '')[:7])
+        for category, values in list(notes_finales.items()) + [(GLOBAL, note_chantier)]:
+            entry = scores[dims + (category,)]
+            entry[2] += 1
+            if not np.isnan(values[j]):
+                entry[0] += float(values[j])
+                entry[1] += 1
+        for i in np.flatnonzero(evaluated[:, j]):
+            criterion = catalogue.criteria[i]
+            entry = criteria[dims + (criterion.category, criterion.label)]
+            entry[0] += int(failed[i, j])
+            entry[1] += 1
+    return scores, criteria
+
+
+def apply(conn, payloads, catalogue, sign=1):
+    """Add (sign=1) or remove (sign=-1) the fiches' contributions to the rollups."""
+    scores, criteria = contributions([p for p in payloads if p is not None], catalogue)
+    conn.executemany(_ADD_SCORES, [key + (sign * total, sign * scored, sign * visits)
+                                   for key, (total, scored, visits) in scores.items()])
+    conn.executemany(_ADD_CRITERIA, [key + (sign * failed, sign * count) for key, (failed, count) in criteria.items()])
+    if sign < 0:
+        conn.execute("DELETE FROM rollup_scores WHERE visits <= 0")
+        conn.execute("DELETE FROM rollup_criteria WHERE evaluated <= 0")
+
+
+def rebuild(conn, catalogue, batch_size=500):
+    # Full recomputation: new store, older rollups or a catalogue change
+    conn.execute("DELETE FROM rollup_scores")
+    conn.execute("DELETE FROM rollup_criteria")
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, payload FROM visits WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        apply(conn, [rollup_payload(row[1], catalogue) for row in rows], catalogue)
+        last_id = rows[-1][0]
+    conn.execute(f"PRAGMA user_version = {int(catalogue.version)}")
+
+
+def _filters(nom_client=None, adresse=None, month_from=None, month_to=None):
+    clauses, params = [], []
+    for clause, value in (("nom_client = ?", nom_client), ("adresse = ?", adresse),
+                          ("month >= ?", month_from), ("month <= ?", month_to)):
+        # '' is a real value: visits saved without a client name
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+
+def clients(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT nom_client FROM rollup_scores ORDER BY nom_client")]
+
+
+def sites(conn, nom_client=None):
+    where, params = _filters(nom_client)
+    return [row[0] for row in conn.execute(
+        f"SELECT DISTINCT adresse FROM rollup_scores {where} ORDER BY adresse", params
+    )]
+
+
+def months(conn, nom_client=None, adresse=None):
+    where, params = _filters(nom_client, adresse)
+    return [row[0] for row in conn.execute(
+        f"SELECT DISTINCT month FROM rollup_scores {where} ORDER BY month", params
+    )]
+
+
+def score_trend(conn, **filters):
+    """{'month', 'category', 'note', 'visits'} per month, averaged over the selection.
+
+    note is None for a month where the category was never scored.
+    """
+    where, params = _filters(**filters)
+    rows = conn.execute(
+        f"SELECT month, category, SUM(total) / NULLIF(SUM(scored), 0), SUM(visits) FROM rollup_scores {where} "
+        "GROUP BY month, category ORDER BY month",
+        params
+    ).fetchall()
+    return [{'month': m, 'category': c, 'note': None if note is None else round(note, 1), 'visits': v}
+            for m, c, note, v in rows]
+
+
+def criteria_failures(conn, limit=10, **filters):
+    """Criteria most often rated "Non Satisfaisant" over the selection."""
+    where, params = _filters(**filters)
+    rows = conn.execute(
+        f"SELECT category, label, SUM(non_satisfaisant) AS failed, SUM(evaluated) FROM rollup_criteria {where} "
+        "GROUP BY category, label HAVING failed > 0 ORDER BY failed DESC, category, label LIMIT ?",
+        params + [limit]
+    ).fetchall()
+    return [{'category': c, 'label': l, 'non_satisfaisant': f, 'evaluated': e} for c, l, f, e in rows]
@@ -0,0 +1,142 @@
+import numpy as np
+
+from catalogue import eval_key
+
+# Pondérations par catégorie
+pondérations = {
+    "Administratif": 0.5,
+    "Sécurité": 3,
+    "Environnement": 1
+}
+
+# Valeurs pondérées des notes
+valeurs = {
+    "Satisfaisant": 1,
+    "Partiellement Satisfaisant": 2/3,
+    "Non Satisfaisant": 1/3,
+    "Non Applicable": None
+}
+
+
+def category_score(notes):
+    # Pourcentage d'une catégorie, "NA" si aucun critère n'est applicable
+    total = 0
+    count = 0
+    for note in notes:
+        valeur = valeurs.get(note)
+        if valeur is not None:
+            total += valeur
+            count += 1
+    if count > 0:
+        moyenne = total / count
+        return round(moyenne * 100)
+    return "NA"
+
+
+def global_score(notes_finales):
+    note_globale_pondérée = 0
+    somme_pondérations = 0
+    for cat, note_pourcentage in notes_finales.items():
+        if note_pourcentage != "NA":
+            note_globale_pondérée += note_pourcentage * pondérations[cat]
+            somme_pondérations += pondérations[cat]
+
+    # Calcul de la note chantier
+    if somme_pondérations > 0:
+        return round(note_globale_pondérée / somme_pondérations, 1)
+    return "NA"
+
+
+def compute_scores(notes_par_categorie):
+    notes_finales = {cat: category_score(notes) for cat, notes in notes_par_categorie.items()}
+    return notes_finales, global_score(notes_finales)
+
+
+def category_notes(fiche, categories):
+    # Évaluations d'une fiche sauvegardée, regroupées par catégorie
+    return {
+        cat: [fiche.get(eval_key(cat, crit), "Non Applicable") for crit in criteres]
+        for cat, criteres in categories.items()
+    }
+
+
+# Codes des évaluations dans la matrice critères × visites
+EVALUATION_CODES = {
+    "Non Applicable": 0,
+    "Non Satisfaisant": 1,
+    "Partiellement Satisfaisant": 2,
+    "Satisfaisant": 3,
+}
+_CODE_VALUES = np.array([0.0, valeurs["Non Satisfaisant"], valeurs["Partiellement Satisfaisant"], valeurs["Satisfaisant"]])
+
+
+def evaluation_matrix(fiches, categories):
+    # int8 matrix, one row per criterion (catalogue order) and one column per visit;
+    # unknown or missing evaluations count as "Non Applicable" like in compute_scores
+    keys = [eval_key(cat, crit) for cat, criteres in categories.items() for crit in criteres]
+    codes = np.zeros((len(keys), len(fiches)), dtype=np.int8)
+    get_code = EVALUATION_CODES.get
+    for j, fiche in enumerate(fiches):
+        codes[:, j] = [get_code(fiche.get(key), 0) for key in keys]
+    return codes
+
+
+def _round_half_even(x, ndigits):
+    # np.round scales by 10**ndigits first, which can turn a value just below
+    # or above a tie into an exact tie; redo those few with Python's round()
+    rounded = np.round(x, ndigits)
+    scaled = x * 10 ** ndigits
+    near_tie = np.isfinite(x) & (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in np.flatnonzero(near_tie):
+        rounded[i] = round(float(x[i]), ndigits)
+    return rounded
+
+
+def score_matrix(codes, categories):
+    """Score every visit of an evaluation matrix at once.
+
+    Returns ({categorie: float array}, global array) with NaN where the app
+    shows "NA". Criteria are accumulated in catalogue order so each float
+    operation matches compute_scores() exactly, including its rounding.
+    """
+    n_visits = codes.shape[1]
+    notes_finales = {}
+    note_globale_pondérée = np.zeros(n_visits)
+    somme_pondérations = np.zeros(n_visits)
+
+    row = 0
+    for cat, criteres in categories.items():
+        total = np.zeros(n_visits)
+        count = np.zeros(n_visits, dtype=np.int64)
+        for _ in criteres:
+            code = codes[row]
+            total += _CODE_VALUES[code]
+            count += code > 0
+            row += 1
+        applicable = count > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            note_pourcentage = np.rint(total / count * 100)
+        note_pourcentage[~applicable] = np.nan
+        notes_finales[cat] = note_pourcentage
+        note_globale_pondérée += np.where(applicable, note_pourcentage * pondérations[cat], 0)
+        somme_pondérations += np.where(applicable, pondérations[cat], 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        note_chantier = _round_half_even(note_globale_pondérée / somme_pondérations, 1)
+    note_chantier[somme_pondérations == 0] = np.nan
+    return notes_finales, note_chantier
+
+
+def score_fiches(fiches, categories):
+    # Fiches sauvegardées (dicts de parse_fiche) notées en une seule passe
+    return score_matrix(evaluation_matrix(fiches, categories), categories)
+
+
+def visit_scores(notes_finales, note_chantier, index):
+    # Scores of one visit in the same form as compute_scores()
+    notes = {
+        cat: "NA" if np.isnan(values[index]) else int(values[index])
+        for cat, values in notes_finales.items()
+    }
+    note = note_chantier[index]
+    return notes, "NA" if np.isnan(note) else float(note)
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import namedtuple
+
+from renderer import _pid_alive
+
+MB = 1024 * 1024
+# Per file, and for everything one session keeps (émargement + photos)
+MAX_UPLOAD_BYTES = int(os.environ.get('BR_MAX_UPLOAD_MB', '25')) * MB
+MAX_SESSION_BYTES = int(os.environ.get('BR_MAX_SESSION_UPLOAD_MB', '300')) * MB
+UPLOAD_PREFIX = 'session-'
+UPLOAD_MAX_AGE = 24 * 3600
+CHUNK_BYTES = MB
+# Names this server process's directories: session-<pid>-<boot id>-<random>
+BOOT_ID = uuid.uuid4().hex[:12]
+
+
+class UploadError(ValueError):
+    pass
+
+
+class Upload(namedtuple('Upload', 'name type digest size path')):
+    """Handle of a spooled file: what the session keeps instead of its bytes."""
+    __slots__ = ()
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+def upload_dir():
+    path = os.environ.get('BR_UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), 'br_uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def clean_uploads(max_age=UPLOAD_MAX_AGE, directory=None):
+    """Remove session directories left behind by a previous or crashed server; returns how many.
+
+    Directories of this process are never touched, however often it runs.
+    """
+    directory = directory or upload_dir()
+    now = time.time()
+    removed = 0
+    for name in os.listdir(directory):
+        if not name.startswith(UPLOAD_PREFIX):
+            continue
+        path = os.path.join(directory, name)
+        pid, _, rest = name[len(UPLOAD_PREFIX):].partition('-')
+        boot_id = rest.partition('-')[0]
+        if pid == str(os.getpid()) and boot_id == BOOT_ID:
+            continue
+        try:
+            pid = int(pid)
+        except ValueError:
+            pid = None
+        try:
+            # Our pid with another boot id: a previous run of a restarted container
+            orphaned = pid is None or pid == os.getpid() or not _pid_alive(pid)
+            if orphaned or now - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+class SessionUploads:
+    """Files uploaded in one browser session, spooled to a scratch directory.
+
+    Each content is stored once, however many times it is uploaded. The
+    directory is removed when the object is dropped with the session state,
+    or at exit.
+    """
+
+    def __init__(self, directory=None, max_file_bytes=MAX_UPLOAD_BYTES, max_bytes=MAX_SESSION_BYTES):
+        self.max_file_bytes = max_file_bytes
+        self.max_bytes = max_bytes
+        self.path = tempfile.mkdtemp(prefix=f"{UPLOAD_PREFIX}{os.getpid()}-{BOOT_ID}-",
+                                     dir=directory or upload_dir())
+        self._refs = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+    @property
+    def size(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def spool(self, upload, max_bytes=None):
+        """Copy an uploaded file to disk in chunks and return its Upload handle.
+
+        Raises UploadError if it is over the per-file limit (or max_bytes) or
+        would take the session over its quota.
+        """
+        limit = min(max_bytes or self.max_file_bytes, self.max_file_bytes)
+        name = getattr(upload, 'name', 'fichier')
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.part')
+        try:
+            upload.seek(0)
+            with os.fdopen(fd, 'wb') as out:
+                while chunk := upload.read(CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > limit:
+                        raise UploadError(f"« {name} » dépasse la taille maximale de {limit // MB} Mo")
+                    hasher.update(chunk)
+                    out.write(chunk)
+            content_digest = hasher.hexdigest()
+            path = os.path.join(self.path, content_digest)
+            with self._lock:
+                if content_digest in self._refs:
+                    os.remove(tmp_path)
+                else:
+                    if sum(self._sizes.values()) + size > self.max_bytes:
+                        raise UploadError(
+                            f"« {name} » non ajouté : limite de {self.max_bytes // MB} Mo de fichiers par session atteinte"
+                        )
+                    os.replace(tmp_path, path)
+                    self._sizes[content_digest] = size
+                self._refs[content_digest] = self._refs.get(content_digest, 0) + 1
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return Upload(name, getattr(upload, 'type', None), content_digest, size, path)
+
+    def release(self, handle):
+        # The file is deleted once no handle of this session refers to it
+        with self._lock:
+            refs = self._refs.get(handle.digest, 0) - 1
+            if refs > 0:
+                self._refs[handle.digest] = refs
+                return
+            self._refs.pop(handle.digest, None)
+            self._sizes.pop(handle.digest, None)
+        try:
+            os.remove(handle.path)
+        except OSError:
+            pass
+
+    def close(self):
+        self._finalizer()
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import rollups
+from fiche import CATALOGUE, compact_fiche, parse_fiche
+
+# Champs indexés, dans l'ordre de recherche
+INDEXED_FIELDS = ['nom_client', 'adresse', 'date', 'redacteur_rapport']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY,
+    nom_client TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    adresse TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    date TEXT NOT NULL COLLATE NOCASE,
+    redacteur_rapport TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    saved_at TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS visits_nom_client ON visits (nom_client, date);
+CREATE INDEX IF NOT EXISTS visits_adresse ON visits (adresse, date);
+CREATE INDEX IF NOT EXISTS visits_date ON visits (date);
+CREATE INDEX IF NOT EXISTS visits_redacteur ON visits (redacteur_rapport, date);
+CREATE TABLE IF NOT EXISTS imported_fiches (
+    digest TEXT PRIMARY KEY,
+    visit_id INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def default_path():
+    return os.environ.get('BR_VISIT_DB') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'visites.db')
+
+
+def _like_prefix(text):
+    # Prefix pattern that SQLite can answer from a NOCASE index
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+
+class VisitStore:
+    """Server-side store of saved fiches, one row per visit.
+
+    The payload is the same JSON as the downloaded fiche; the searchable
+    fields are copied into indexed columns so lookups stay fast with tens of
+    thousands of visits. Every write also updates the score rollups read by
+    the dashboard (see rollups.py).
+    """
+
+    def __init__(self, path, catalogue=CATALOGUE):
+        self.path = path
+        self.catalogue = catalogue
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA + rollups.SCHEMA)
+            # Rollups are computed against one catalogue version
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != catalogue.version:
+                with self._conn:
+                    rollups.rebuild(self._conn, catalogue)
+
+    @staticmethod
+    def _row(payload):
+        row = {field: str(payload.get(field) or '') for field in INDEXED_FIELDS}
+        row['saved_at'] = datetime.now().isoformat(timespec='seconds')
+        row['payload'] = json.dumps(payload, ensure_ascii=False, default=str)
+        return row
+
+    def save(self, payload, visit_id=None):
+        # Update the visit previously saved from this session, if any
+        row = self._row(payload)
+        new = rollups.rollup_payload(payload, self.catalogue)
+        with self._lock, self._conn:
+            if visit_id is not None:
+                old = self._conn.execute("SELECT payload FROM visits WHERE id = ?", (visit_id,)).fetchone()
+                cursor = self._conn.execute(
+                    "UPDATE visits SET nom_client = :nom_client, adresse = :adresse, date = :date, "
+                    "redacteur_rapport = :redacteur_rapport, saved_at = :saved_at, payload = :payload "
+                    "WHERE id = :id",
+                    dict(row, id=visit_id)
+                )
+                if cursor.rowcount:
+                    rollups.apply(self._conn, [rollups.rollup_payload(old['payload'], self.catalogue)],
+                                  self.catalogue, sign=-1)
+                    rollups.apply(self._conn, [new], self.catalogue)
+                    return visit_id
+            cursor = self._conn.execute(
+                "INSERT INTO visits (nom_client, adresse, date, redacteur_rapport, saved_at, payload) "
+                "VALUES (:nom_client, :adresse, :date, :redacteur_rapport, :saved_at, :payload)",
+                row
+            )
+            rollups.apply(self._conn, [new], self.catalogue)
+            return cursor.lastrowid
+
+    @staticmethod
+    def _digest(payload):
+        # Compact form: the same fiche whatever the file format it came in
+        canonical = json.dumps(compact_fiche(payload), ensure_ascii=False, default=str, sort_keys=True,
+                               separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def save_many(self, payloads):
+        """Insert imported visits in a single transaction; returns their ids.
+
+        A fiche already imported with the same content is skipped and gets None.
+        """
+        ids = []
+        inserted = []
+        with self._lock, self._conn:
+            for payload in payloads:
+                content_digest = self._digest(payload)
+                if self._conn.execute("SELECT 1 FROM imported_fiches WHERE digest = ?", (content_digest,)).fetchone():
+                    ids.append(None)
+                    continue
+                visit_id = self._conn.execute(
+                    "INSERT INTO visits (nom_client, adresse, date, redacteur_rapport, saved_at, payload) "
+                    "VALUES (:nom_client, :adresse, :date, :redacteur_rapport, :saved_at, :payload)",
+                    self._row(payload)
+                ).lastrowid
+                self._conn.execute(
+                    "INSERT INTO imported_fiches (digest, visit_id) VALUES (?, ?)", (content_digest, visit_id)
+                )
+                ids.append(visit_id)
+                inserted.append(payload)
+            rollups.apply(self._conn, [rollups.rollup_payload(payload, self.catalogue) for payload in inserted],
+                          self.catalogue)
+            return ids
+
+    def search(self, text='', limit=50):
+        """Most recent visits whose client, address, date or author starts with text."""
+        columns = "id, nom_client, adresse, date, redacteur_rapport, saved_at"
+        text = text.strip()
+        with self._lock:
+            if not text:
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM visits ORDER BY date DESC, id DESC LIMIT ?",
+                    (limit,)
+                ).fetchall()
+            else:
+                pattern = _like_prefix(text)
+                where = " OR ".join(f"{field} LIKE :pattern ESCAPE '\\'" for field in INDEXED_FIELDS)
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM visits WHERE {where} ORDER BY date DESC, id DESC LIMIT :limit",
+                    {'pattern': pattern, 'limit': limit}
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load(self, visit_id):
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM visits WHERE id = ?", (visit_id,)).fetchone()
+        if row is None:
+            return None
+        return parse_fiche(row['payload'])
+
+    def find(self, nom_client=None, date_from=None, date_to=None):
+        """Summaries of a client's visits (exact name, any case) in a date range, oldest first."""
+        clauses, params = [], []
+        if nom_client:
+            clauses.append("nom_client = ?")
+            params.append(nom_client.strip())
+        if date_from:
+            clauses.append("date >= ?")
+            params.append(str(date_from))
+        if date_to:
+            clauses.append("date <= ?")
+            params.append(str(date_to))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, nom_client, adresse, date, redacteur_rapport, saved_at "
+                f"FROM visits {where} ORDER BY date, id",
+                params
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_payloads(self, ids, batch_size=50):
+        """Parsed fiches of ids, in that order, fetched batch_size rows at a time."""
+        ids = list(ids)
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT id, payload FROM visits WHERE id IN ({placeholders})", batch
+                ).fetchall()
+            payloads = {row['id']: row['payload'] for row in rows}
+            for visit_id in batch:
+                if visit_id not in payloads:
+                    # Deleted meanwhile: callers pair fiches with ids by position
+                    raise LookupError(f"Visite {visit_id} introuvable")
+                yield parse_fiche(payloads.pop(visit_id))
+
+    def migrate(self, catalogue, batch_size=500):
+        """Upgrade every stored payload to catalogue, in one transaction; returns how many changed."""
+        changed = 0
+        last_id = 0
+        with self._lock, self._conn:
+            while True:
+                # Keyset pagination keeps memory bounded on large stores
+                rows = self._conn.execute(
+                    "SELECT id, payload FROM visits WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                updates = []
+                for row in rows:
+                    payload = json.loads(row['payload'])
+                    if catalogue.migrate(payload):
+                        updates.append((json.dumps(payload, ensure_ascii=False, default=str), row['id']))
+                self._conn.executemany("UPDATE visits SET payload = ? WHERE id = ?", updates)
+                changed += len(updates)
+                last_id = rows[-1]['id']
+            if changed or catalogue is not self.catalogue:
+                self.catalogue = catalogue
+                rollups.rebuild(self._conn, catalogue)
+        return changed
+
+    def clients(self):
+        with self._lock:
+            return rollups.clients(self._conn)
+
+    def sites(self, nom_client=None):
+        with self._lock:
+            return rollups.sites(self._conn, nom_client)
+
+    def months(self, nom_client=None, adresse=None):
+        with self._lock:
+            return rollups.months(self._conn, nom_client, adresse)
+
+    def score_trend(self, **filters):
+        # filters: nom_client, adresse, month_from, month_to ('AAAA-MM')
+        with self._lock:
+            return rollups.score_trend(self._conn, **filters)
+
+    def criteria_failures(self, limit=10, **filters):
+        with self._lock:
+            return rollups.criteria_failures(self._conn, limit, **filters)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM visits").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()